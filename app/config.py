@@ -30,5 +30,12 @@ class Settings(BaseSettings):
 
     # a . at the beginning means inside the repo (support depends on repo_plugin)
     specs: str = "./yac.yml"
+    # seconds until a specs file (not in the repo) is checked for changes again
+    specs_file_check_interval: float = 1.0
+
+    # DNS lookups of j2 plugins (see app/lib/resolver.py), TTLs are in seconds
+    dns_concurrency: int = 32
+    dns_ttl: float = 300.0
+    dns_negative_ttl: float = 60.0
 
     env: dict = {}  # custom env vars available in props
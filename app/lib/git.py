@@ -6,6 +6,10 @@ Raises: [app.lib.git.GitError, app.lib.git.GitTimeoutError]
 
 import asyncio
 import logging
+import re
+import time
+from collections import deque
+from typing import NamedTuple
 
 from anyio import Path
 
@@ -20,8 +24,181 @@ class GitTimeoutError(GitError):
     pass
 
 
+class BatchInfo(NamedTuple):
+    calls: int
+    restarts: int
+    latency_avg: float
+    latency_max: float
+
+
+class Batch:
+    """
+    A long-lived git cat-file --batch (or --batch-check if check is set)
+    process per repo, so reading objects (or resolving refs) does not need to
+    start a new process every time. Requests are pipelined: they are written
+    right away and the answers are read in the same order. The process is
+    restarted if it fails or a request times out.
+    """
+
+    _instances: dict[tuple[str, bool], "Batch"] = {}
+
+    def __init__(self, path: str, env: dict[str, str], check: bool) -> None:
+        self.path = path
+        self.env = env
+        self.check = check
+        self._proc: asyncio.subprocess.Process | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._pending: deque[asyncio.Future] = deque()
+        self._reader: asyncio.Task | None = None
+        self._starting: asyncio.Task | None = None
+        self._stats = {"calls": 0, "restarts": -1, "total": 0.0, "max": 0.0}
+
+    @classmethod
+    def get(cls, path: str, env: dict[str, str], check: bool = False) -> "Batch":
+        if (path, check) not in cls._instances:
+            cls._instances[(path, check)] = cls(path, env, check)
+        return cls._instances[(path, check)]
+
+    @classmethod
+    async def reset(cls, path: str) -> None:
+        """
+        Stops the processes of the repo at path (e.g. before it is replaced).
+        """
+        for check in (False, True):
+            batch = cls._instances.pop((path, check), None)
+            if batch is not None:
+                await batch.__close()
+
+    @classmethod
+    def info(cls) -> dict[str, BatchInfo]:
+        """
+        Statistics of all batch processes by "{path}:batch" (or batch-check).
+        """
+        infos = {}
+        for (path, check), batch in cls._instances.items():
+            stats = batch._stats  # pylint: disable=protected-access
+            infos[f"{path}:batch{'-check' if check else ''}"] = BatchInfo(
+                stats["calls"],
+                max(stats["restarts"], 0),
+                stats["total"] / stats["calls"] if stats["calls"] else 0.0,
+                stats["max"],
+            )
+        return infos
+
+    async def query(
+        self, obj: str, *, timeout: int = 3
+    ) -> tuple[str, str, bytes | None] | None:
+        """
+        Returns object id, type and content (None for batch-check) of obj or
+        None if obj does not exist.
+        """
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        while (
+            self._proc is None
+            or self._proc.returncode is not None
+            or self._loop is not loop
+        ):
+            # Concurrent queries wait for the same start (instead of starting
+            # one process each)
+            if (
+                self._starting is None
+                or self._starting.done()
+                or self._starting.get_loop() is not loop
+            ):
+                self._starting = loop.create_task(self.__start())
+            await asyncio.shield(self._starting)
+        future = self._loop.create_future()
+        self._pending.append(future)
+        try:
+            self._proc.stdin.write(f"{obj}\n".encode())
+            await self._proc.stdin.drain()
+            result = await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except asyncio.TimeoutError as error:
+            self.__stop(GitTimeoutError(f"Timeout of {timeout} seconds exceeded"))
+            raise GitTimeoutError(f"Timeout of {timeout} seconds exceeded") from error
+        except (OSError, RuntimeError) as error:
+            self.__stop(GitError(f"git cat-file failed with: {error}"))
+            raise GitError(f"git cat-file failed with: {error}") from error
+
+        latency = time.monotonic() - start
+        self._stats["calls"] += 1
+        self._stats["total"] += latency
+        self._stats["max"] = max(self._stats["max"], latency)
+        return result
+
+    async def __start(self) -> None:
+        self.__stop(GitError("git cat-file was restarted"))
+        logger.debug(f"Starting git cat-file for {self.path}")
+        self._stats["restarts"] += 1
+        self._loop = asyncio.get_running_loop()
+        self._proc = await asyncio.create_subprocess_exec(
+            "/usr/bin/git",
+            "cat-file",
+            "--batch-check" if self.check else "--batch",
+            env=self.env,
+            cwd=self.path,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        self._reader = self._loop.create_task(self.__read(self._proc))
+
+    async def __close(self) -> None:
+        proc = self._proc
+        self.__stop(GitError("git cat-file was stopped"))
+        if proc is not None and self._loop is asyncio.get_running_loop():
+            await proc.wait()
+
+    def __stop(self, error: GitError) -> None:
+        if self._proc is not None and self._proc.returncode is None:
+            try:
+                self._proc.kill()
+            except (ProcessLookupError, RuntimeError):
+                pass  # already gone or its event loop is closed
+        if self._reader is not None and not self._loop.is_closed():
+            self._reader.cancel()
+        self._proc = None
+        self._reader = None
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    async def __read(self, proc: asyncio.subprocess.Process) -> None:
+        try:
+            while True:
+                header = await proc.stdout.readline()
+                if not header:
+                    raise GitError("git cat-file exited unexpectedly")
+                parts = header.decode().split()
+                result = None
+                if len(parts) == 3:
+                    content = None
+                    if not self.check:
+                        content = await proc.stdout.readexactly(int(parts[2]) + 1)
+                        content = content[:-1]  # without the trailing newline
+                    result = (parts[0], parts[1], content)
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_result(result)
+        except (
+            GitError,
+            OSError,
+            IndexError,
+            ValueError,
+            asyncio.IncompleteReadError,
+        ) as error:
+            if self._proc is proc:
+                self.__stop(GitError(f"git cat-file failed with: {error}"))
+
+
 class Repo:
 
+    # HEAD of every repo (by path): the files read to resolve it with their
+    # (inode, mtime, size) at that time and the commit
+    _heads: dict[str, tuple[list[str], list[tuple | None], str]] = {}
+
     def __init__(self, path: str, env: dict[str, str] = {}) -> None:
         self.loaded = False
         self.path = path
@@ -56,27 +233,85 @@ class Repo:
         self.loaded = True
 
     async def clone(
-        self, url: str, *, depth: int = 1, branch: str = "main", timeout: int = 30
+        self,
+        url: str,
+        *,
+        depth: int | None = 1,
+        branch: str = "main",
+        timeout: int = 30,
+        bare: bool = False,
+        shared: bool = False,
     ) -> None:
+        """
+        Clones the branch with depth commits (or all if None). A bare clone
+        only has this branch. A shared clone uses the objects of the repo at
+        url (a local path of a repo that is not shallow) instead of copying
+        them (see git clone --shared).
+        """
         try:
             await Path(self.path).mkdir(parents=True, exist_ok=True)
         except OSError as error:
             raise GitError(f"Unable to create {self.path}: {error}")
-        await self.__run(
-            "clone",
-            "--depth",
-            str(depth),
-            "--branch",
-            branch,
-            url,
-            ".",
-            timeout=timeout,
-        )
+        await Batch.reset(self.path)
+        args = ["clone"]
+        if depth is not None:
+            args.extend(["--depth", str(depth)])
+        if bare:
+            args.extend(["--bare", "--single-branch"])
+        if shared:
+            args.append("--shared")
+        await self.__run(*args, "--branch", branch, url, ".", timeout=timeout)
         self.loaded = True
 
+    async def set_config(self, key: str, value: str) -> None:
+        await self.__run("config", key, value, timeout=3)
+
     async def pull(self, timeout: int = 5) -> None:
         await self.__run("pull", timeout=timeout)
 
+    async def fetch(self, timeout: int = 5) -> None:
+        await self.__run("fetch", timeout=timeout)
+
+    async def ls_remote(self, url: str, ref: str, timeout: int = 5) -> str | None:
+        """
+        The commit ref (e.g. refs/heads/main) points to in the repo at url or
+        None if it does not exist.
+        """
+        result = await self.__run("ls-remote", url, ref, timeout=timeout)
+        for line in result.splitlines():
+            commit, _, name = line.partition("\t")
+            if name == ref:
+                return commit
+        return None
+
+    async def merge(self, rev: str, *, ff_only: bool = True) -> None:
+        args = ["merge"]
+        if ff_only:
+            args.append("--ff-only")
+        await self.__run(*args, rev, timeout=3)
+
+    async def cherry_pick(self, commit: str) -> None:
+        """
+        Applies commit onto HEAD (and aborts if that fails).
+        """
+        try:
+            await self.__run("cherry-pick", commit, timeout=5)
+        except GitError:
+            try:
+                await self.__run("cherry-pick", "--abort", timeout=3)
+            except GitError:
+                pass  # e.g. the cherry-pick did not even start
+            raise
+
+    async def changed_files(self, old: str, new: str, files: list[str]) -> list[str]:
+        """
+        The files (of the given ones) that differ between the commits old and new.
+        """
+        result = await self.__run(
+            "diff", "--name-only", "-z", old, new, "--", *files, timeout=3
+        )
+        return [f for f in result.split("\0") if f]
+
     async def add(self, files: list[str]) -> None:
         await self.__run("add", *files, timeout=3)
 
@@ -99,7 +334,7 @@ class Repo:
         args = ["reset"]
         if hard:
             args.append("--hard")
-        await self.__run(*args, timeout=3)
+        await self.__run(*args, branch, timeout=3)
 
     async def clean(self, recursive: bool = True, force: bool = True) -> None:
         args = ["clean"]
@@ -110,7 +345,131 @@ class Repo:
         await self.__run(*args, timeout=3)
 
     async def get_hash(self) -> str:
-        return (await self.__run("rev-parse", "HEAD", timeout=3)).strip()
+        """
+        Resolves HEAD by reading the files in .git (cached until one of them
+        changes) and only falls back to git if that fails.
+        """
+        try:
+            commit = await self.__read_head()
+        except (OSError, ValueError) as error:
+            logger.debug(f"Cannot read HEAD of {self.path} directly: {error}")
+            commit = None
+        if commit is not None:
+            return commit
+        result = await Batch.get(self.path, self.env, check=True).query("HEAD")
+        if result is None:
+            raise GitError(f"HEAD of {self.path} does not exist")
+        return result[0]
+
+    async def __read_head(self) -> str | None:
+        cached = Repo._heads.get(self.path)
+        if cached is not None:
+            files, stamps, commit = cached
+            if [await self.__stamp(f) for f in files] == stamps:
+                return commit
+
+        gitdir, commondir = await self.__get_dirs()
+        files = [f"{gitdir}/HEAD"]
+        stamps = [await self.__stamp(files[0])]
+        head = (await Path(files[0]).read_text()).strip()
+        for _ in range(5):
+            if not head.startswith("ref: "):
+                break
+            ref = head[5:].strip()
+            files.append(f"{commondir}/{ref}")
+            stamps.append(await self.__stamp(files[-1]))
+            if stamps[-1] is not None:
+                head = (await Path(files[-1]).read_text()).strip()
+                continue
+            files.append(f"{commondir}/packed-refs")
+            stamps.append(await self.__stamp(files[-1]))
+            head = await self.__read_packed_ref(files[-1], ref)
+
+        if not re.fullmatch(r"[0-9a-f]{40}|[0-9a-f]{64}", head):
+            return None  # e.g. a branch without commits
+        Repo._heads[self.path] = (files, stamps, head)
+        return head
+
+    async def __get_dirs(self) -> tuple[str, str]:
+        """
+        Returns the git dir and the common dir (where the refs are) which only
+        differ for linked worktrees (where .git is a file).
+        """
+        gitdir = f"{self.path}/.git"
+        if await Path(gitdir).is_dir():
+            return gitdir, gitdir
+        content = (await Path(gitdir).read_text()).strip()
+        if not content.startswith("gitdir: "):
+            raise ValueError(f"{gitdir} is not a git dir")
+        gitdir = str(Path(self.path) / content[8:])
+        try:
+            common = (await Path(f"{gitdir}/commondir").read_text()).strip()
+        except FileNotFoundError:
+            return gitdir, gitdir
+        return gitdir, str(Path(gitdir) / common)
+
+    @staticmethod
+    async def __stamp(file: str) -> tuple | None:
+        try:
+            stat = await Path(file).stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    @staticmethod
+    async def __read_packed_ref(file: str, ref: str) -> str:
+        try:
+            content = await Path(file).read_text()
+        except FileNotFoundError:
+            return ""
+        for line in content.splitlines():
+            if line.startswith(("#", "^")):
+                continue
+            commit, _, name = line.partition(" ")
+            if name == ref:
+                return commit
+        return ""
+
+    async def read_blob(self, obj: str) -> bytes:
+        result = await Batch.get(self.path, self.env).query(obj)
+        if result is None or result[1] != "blob":
+            raise GitError(f"Blob {obj} does not exist")
+        return result[2]
+
+    async def ls_tree(self, rev: str = "HEAD") -> list[tuple[str, str, str, str]]:
+        """
+        Returns mode, type, object id and path of all files (recursively).
+        """
+        out = await self.__run("ls-tree", "-r", "-z", rev, timeout=10)
+        entries = []
+        for line in out.split("\0"):
+            if line:
+                info, path = line.split("\t", 1)
+                mode, kind, obj = info.split(" ")
+                entries.append((mode, kind, obj, path))
+        return entries
+
+    async def diff_tree(self, old: str, new: str) -> list[tuple[str, str, str, str]]:
+        """
+        Returns status (A, D, M or T), new mode, new object id and path of all
+        files changed between the two commits (renames are an A and a D).
+        """
+        out = await self.__run(
+            "diff-tree", "-r", "-z", "--no-renames", old, new, timeout=10
+        )
+        tokens = out.split("\0")
+        changes = []
+        for info, path in zip(tokens[0::2], tokens[1::2]):
+            _, mode, _, obj, status = info.lstrip(":").split(" ")
+            changes.append((status, mode, obj, path))
+        return changes
+
+    async def cat_blobs(self, objs: list[str]) -> dict[str, bytes]:
+        """
+        Returns the content of all the blobs by their object id.
+        """
+        blobs = await asyncio.gather(*(self.read_blob(obj) for obj in objs))
+        return dict(zip(objs, blobs))
 
     async def get_fetch_time(self) -> float:
         file = f"{self.path}/.git/FETCH_HEAD"
@@ -2,13 +2,25 @@
 Raises: [app.lib.j2.J2Error]
 """
 
+import asyncio
+import functools
+import inspect
 import json
 import re
+from functools import lru_cache
+from typing import Any, Callable
 
 import jinja2
+from jinja2 import meta
+from jinja2 import nodes
 
 from app.lib import plugin
 
+TEMPLATE_CACHE_SIZE = 4096
+
+# Only used to parse templates, never to render them
+__parser = jinja2.Environment()
+
 
 class J2Error(Exception):
     loc = "#"
@@ -17,13 +29,51 @@ class J2Error(Exception):
 def render(
     o, props: dict = {}, *, strict: bool = True
 ):  # pylint: disable=dangerous-default-value
-    if isinstance(o, dict):
-        return __render_dict(o, props, strict=strict)
-    if isinstance(o, list):
-        return __render_list(o, props, strict=strict)
-    if isinstance(o, str):
-        return render_str(o, props, strict=strict)
-    return o
+    return prerender(o, strict=strict)(props)
+
+
+async def render_async(
+    o, props: dict = {}, *, strict: bool = True
+):  # pylint: disable=dangerous-default-value
+    return await prerender(o, strict=strict, is_async=True)(props)
+
+
+def prerender(
+    o,
+    static_props: dict = {},
+    *,
+    strict: bool = True,
+    shared: bool = False,
+    is_async: bool = False,
+) -> Callable[[dict], Any]:  # pylint: disable=dangerous-default-value
+    """
+    Compiles o into a single function that renders it with the given props.
+    All strings in o that reference nothing but static_props are rendered right
+    away. So the result of prerender(o, static_props)(props) is the same as
+    render(o, props) as long as props contains static_props.
+
+    Strings using functions, plugin filters or plugin tests are never rendered
+    in advance, as they might not always return the same.
+
+    If shared is set, the static parts of the result are not copied for every
+    call, so the result must not be modified then!
+
+    If is_async is set, the returned function is a coroutine function, which
+    renders all strings calling blocking plugin functions concurrently (see
+    plugin.blocking) without blocking the event loop. Strings using blocking
+    plugin tests are rendered synchronously in a thread instead, as jinja2
+    does not await tests passed by name (e.g. to select).
+    """
+    static, r = __compile(
+        o, static_props, (), strict=strict, shared=shared, is_async=is_async
+    )
+    if static:
+        f = (lambda props: r) if shared else (lambda props: __copy(r))
+    else:
+        f = r
+    if is_async and not inspect.iscoroutinefunction(f):
+        return __as_async(f)
+    return f
 
 
 def render_file(path, file, props, *, strict: bool = True):
@@ -49,6 +99,38 @@ def render_test(
     return bool(render_str(f"{{{{ {test_str} }}}}", props, allow_nonstr=True))
 
 
+async def render_tests_async(
+    test_strs: list[str], props: dict = {}
+) -> list[bool | J2Error]:  # pylint: disable=dangerous-default-value
+    """
+    Renders all the tests (concurrently as far as they call blocking plugin
+    functions) and returns the result or the J2Error for each of them.
+    """
+    results: list[bool | J2Error] = [False] * len(test_strs)
+    pending = []
+    for i, test_str in enumerate(test_strs):
+        s = f"{{{{ {test_str} }}}}"
+        if __may_block(s):
+            pending.append((i, s))
+            continue
+        try:
+            results[i] = bool(render_str(s, props, allow_nonstr=True))
+        except J2Error as error:
+            results[i] = error
+
+    async def render_pending(s: str) -> bool | J2Error:
+        try:
+            return bool(await render_str_async(s, props, allow_nonstr=True))
+        except J2Error as error:
+            return error
+
+    for (i, _), r in zip(
+        pending, await asyncio.gather(*(render_pending(s) for _, s in pending))
+    ):
+        results[i] = r
+    return results
+
+
 def render_print(
     print_str: str, props: dict = {}, *, strict: bool = True
 ) -> str:  # pylint: disable=dangerous-default-value
@@ -58,18 +140,164 @@ def render_print(
 
 
 def render_str(s, props, *, allow_nonstr: bool = True, strict: bool = True):
-    nonstr = re.match(r"^\{\{.+\}\}$", s) and allow_nonstr
+    if __is_literal(s):
+        # That's what jinja2 does with strings without tags
+        return s[:-1] if s.endswith("\n") else s
+    nonstr = bool(re.match(r"^\{\{.+\}\}$", s)) and allow_nonstr
+    try:
+        template = __get_template(s, nonstr, strict)
+    except Exception as error:
+        raise J2Error(f'Templating str "{s}" failed with: {error}') from error
+    return __render_template(template, s, nonstr, props)
+
+
+async def render_str_async(
+    s, props, *, allow_nonstr: bool = True, strict: bool = True
+):
+    if not __may_block(s):
+        return render_str(s, props, allow_nonstr=allow_nonstr, strict=strict)
+    if __uses_blocking_test(s):
+        return await asyncio.to_thread(
+            render_str, s, props, allow_nonstr=allow_nonstr, strict=strict
+        )
+    nonstr = bool(re.match(r"^\{\{.+\}\}$", s)) and allow_nonstr
+    try:
+        template = __get_template(s, nonstr, strict, True)
+    except Exception as error:
+        raise J2Error(f'Templating str "{s}" failed with: {error}') from error
+    return await __render_template_async(template, s, nonstr, props)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def get_references(s: str) -> frozenset[str] | None:
+    """
+    The names of all (top-level) variables and functions s refers to or None if
+    s can not be parsed.
+    """
+    try:
+        return frozenset(meta.find_undeclared_variables(__parser.parse(s)))
+    except jinja2.exceptions.TemplateSyntaxError:
+        return None
+
+
+def cache_info():
+    """
+    Statistics of the compiled templates cache (see functools.lru_cache).
+    """
+    return __get_template.cache_info()
+
+
+@lru_cache(maxsize=None)
+def __get_environment(
+    nonstr: bool, strict: bool, is_async: bool = False
+) -> jinja2.Environment:
     j2 = jinja2.Environment(
         loader=jinja2.BaseLoader(),
         undefined=jinja2.StrictUndefined if strict else jinja2.DebugUndefined,
         trim_blocks=not nonstr,
         finalize=json.dumps if nonstr else None,
+        enable_async=is_async,
     )
-    j2.globals.update(plugin.get_functions("j2_functions"))
-    j2.filters.update(plugin.get_functions("j2_filters"))
-    j2.tests.update(plugin.get_functions("j2_tests"))
+    j2.globals.update(__get_functions("j2_functions", is_async))
+    j2.filters.update(__get_functions("j2_filters", is_async))
+    j2.tests.update(__get_functions("j2_tests", is_async))
+    return j2
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def __get_template(
+    s: str, nonstr: bool, strict: bool, is_async: bool = False
+) -> jinja2.Template:
+    return __get_environment(nonstr, strict, is_async).from_string(s)
+
+
+def __get_functions(kind: str, is_async: bool) -> dict[str, Callable]:
+    """
+    When rendering asynchronously, blocking functions and filters are run in a
+    thread. Tests are never wrapped, as jinja2 does not await them everywhere
+    (see __uses_blocking_test).
+    """
+    functions = plugin.get_functions(kind)
+    if not is_async or kind == "j2_tests":
+        return functions
+    return {
+        name: __to_thread(f) if plugin.is_blocking(f) else f
+        for name, f in functions.items()
+    }
+
+
+def __to_thread(f: Callable) -> Callable:
+    @functools.wraps(f)
+    async def run(*args, **kwargs):
+        return await asyncio.to_thread(f, *args, **kwargs)
+
+    return run
+
+
+def __as_async(f: Callable) -> Callable:
+    async def run(props):
+        return f(props)
+
+    return run
+
+
+@lru_cache(maxsize=None)
+def __get_blocking() -> frozenset[str]:
+    return frozenset(
+        name
+        for kind in ("j2_functions", "j2_filters", "j2_tests")
+        for name, f in plugin.get_functions(kind).items()
+        if plugin.is_blocking(f)
+    )
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def __uses_blocking_test(s: str) -> bool:
+    """
+    If s uses any blocking plugin test, directly or by name (e.g. select), so
+    it has to be rendered synchronously in a thread.
+    """
+    blocking = frozenset(
+        name
+        for name, f in plugin.get_functions("j2_tests").items()
+        if plugin.is_blocking(f)
+    )
+    if not blocking:
+        return False
+    try:
+        ast = __parser.parse(s)
+    except jinja2.exceptions.TemplateSyntaxError:
+        return False  # let it fail when rendering
+    for node in ast.find_all((nodes.Test, nodes.Const)):
+        name = node.name if isinstance(node, nodes.Test) else node.value
+        if isinstance(name, str) and name in blocking:
+            return True
+    return False
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def __may_block(s: str) -> bool:
+    """
+    If s uses any blocking plugin function (or a variable or string of the same
+    name, e.g. a filter or test passed by name to map or select).
+    """
+    blocking = __get_blocking()
+    if not blocking or __is_literal(s):
+        return False
     try:
-        result = j2.from_string(s).render(props)
+        ast = __parser.parse(s)
+    except jinja2.exceptions.TemplateSyntaxError:
+        return False  # let it fail when rendering
+    for node in ast.find_all((nodes.Name, nodes.Filter, nodes.Test, nodes.Const)):
+        name = node.value if isinstance(node, nodes.Const) else node.name
+        if isinstance(name, str) and name in blocking:
+            return True
+    return False
+
+
+def __render_template(template: jinja2.Template, s: str, nonstr: bool, props):
+    try:
+        result = template.render(props)
     except (jinja2.exceptions.UndefinedError, Exception) as error:
         # Must expect any Exception from plugins!
         raise J2Error(f'Templating str "{s}" failed with: {error}') from error
@@ -84,37 +312,220 @@ def render_str(s, props, *, allow_nonstr: bool = True, strict: bool = True):
         return result
 
 
-def __render_dict(d, props, *, strict: bool = True):
-    r = {}
-    for k, v in d.items():
+async def __render_template_async(
+    template: jinja2.Template, s: str, nonstr: bool, props
+):
+    try:
+        result = await template.render_async(props)
+    except (jinja2.exceptions.UndefinedError, Exception) as error:
+        # Must expect any Exception from plugins!
+        raise J2Error(f'Templating str "{s}" failed with: {error}') from error
+    if nonstr:
+        try:
+            return json.loads(result)
+        except ValueError as error:
+            raise J2Error(
+                f'Templating str "{s}" caused a value error: {error}'
+            ) from error
+    else:
+        return result
+
+
+def __is_literal(s: str) -> bool:
+    """
+    Strings without any jinja2 tags (and carriage returns, which jinja2 would
+    normalize) are rendered to themselves (see render_str).
+    """
+    return "\r" not in s and (
+        "{" not in s or ("{{" not in s and "{%" not in s and "{#" not in s)
+    )
+
+
+def __is_static(s: str, static_props: dict) -> bool:
+    if __is_literal(s):
+        return True
+    if not static_props:
+        return False  # no need to parse it
+    try:
+        ast = __parser.parse(s)
+    except jinja2.exceptions.TemplateSyntaxError:
+        return False  # let it fail when rendering
+    if not meta.find_undeclared_variables(ast).issubset(static_props.keys()):
+        return False
+    filters = plugin.get_functions("j2_filters")
+    tests = plugin.get_functions("j2_tests")
+    for node in ast.find_all((nodes.Filter, nodes.Test)):
+        if node.name in (filters if isinstance(node, nodes.Filter) else tests):
+            return False
+    return True
+
+
+def __copy(o):
+    if isinstance(o, dict):
+        return {k: __copy(v) for k, v in o.items()}
+    if isinstance(o, list):
+        return [__copy(v) for v in o]
+    return o
+
+
+def __loc(path: tuple) -> str:
+    # The keys (or values for lists) from the leaf up to the root, as the
+    # locations have always been reported this way.
+    return "".join(["#"] + [f"/{p}" for p in reversed(path)])
+
+
+def __compile(
+    o, static_props, path, *, strict: bool, shared: bool, is_async: bool
+) -> tuple[bool, Any]:
+    """
+    Returns True and the rendered o if o is static, otherwise False and a
+    function to render o (a coroutine function if it needs to be awaited).
+    """
+    if isinstance(o, dict):
+        return __compile_dict(
+            o, static_props, path, strict=strict, shared=shared, is_async=is_async
+        )
+    if isinstance(o, list):
+        return __compile_list(
+            o, static_props, path, strict=strict, shared=shared, is_async=is_async
+        )
+    if isinstance(o, str):
+        return __compile_str(o, static_props, path, strict=strict, is_async=is_async)
+    return True, o
+
+
+def __compile_str(
+    s, static_props, path, *, strict: bool, is_async: bool
+) -> tuple[bool, Any]:
+    loc = __loc(path)
+
+    if __is_static(s, static_props):
+        try:
+            return True, render_str(s, static_props, strict=strict)
+        except J2Error as error:
+            error.loc = loc
+            raise error
+
+    if is_async and __may_block(s):
+        if __uses_blocking_test(s):
+            return False, __compile_str_in_thread(s, loc, strict=strict)
+        return False, __compile_str_async(s, loc, strict=strict)
+
+    nonstr = bool(re.match(r"^\{\{.+\}\}$", s))
+    try:
+        template = __get_template(s, nonstr, strict)
+    except Exception:  # pylint: disable=broad-exception-caught
+        template = None  # let it fail when rendering
+
+    def render_leaf(props):
+        try:
+            if template is None:
+                return render_str(s, props, strict=strict)
+            return __render_template(template, s, nonstr, props)
+        except J2Error as error:
+            error.loc = loc
+            raise error
+
+    return False, render_leaf
+
+
+def __compile_str_async(s, loc, *, strict: bool) -> Callable:
+    nonstr = bool(re.match(r"^\{\{.+\}\}$", s))
+    try:
+        template = __get_template(s, nonstr, strict, True)
+    except Exception:  # pylint: disable=broad-exception-caught
+        template = None  # let it fail when rendering
+
+    async def render_leaf_async(props):
         try:
-            if isinstance(v, dict):
-                r.update({k: __render_dict(v, props, strict=strict)})
-            elif isinstance(v, list):
-                r.update({k: __render_list(v, props, strict=strict)})
-            elif isinstance(v, str):
-                r.update({k: render_str(v, props, strict=strict)})
-            else:
-                r.update({k: v})
+            if template is None:
+                return await render_str_async(s, props, strict=strict)
+            return await __render_template_async(template, s, nonstr, props)
         except J2Error as error:
-            error.loc = f"{error.loc}/{k}"
+            error.loc = loc
             raise error
-    return r
+
+    return render_leaf_async
 
 
-def __render_list(l, props, *, strict: bool = True):
-    r = []
-    for v in l:
+def __compile_str_in_thread(s, loc, *, strict: bool) -> Callable:
+    async def render_leaf_in_thread(props):
         try:
-            if isinstance(v, dict):
-                r.append(__render_dict(v, props, strict=strict))
-            elif isinstance(v, list):
-                r.append(__render_list(v, props, strict=strict))
-            elif isinstance(v, str):
-                r.append(render_str(v, props, strict=strict))
-            else:
-                r.append(v)
+            return await asyncio.to_thread(render_str, s, props, strict=strict)
         except J2Error as error:
-            error.loc = f"{error.loc}/{v}"
+            error.loc = loc
             raise error
-    return r
+
+    return render_leaf_in_thread
+
+
+def __compile_dict(
+    d, static_props, path, *, strict: bool, shared: bool, is_async: bool
+):
+    base = {}
+    dynamic = []
+    copies = []
+    for k, v in d.items():
+        static, r = __compile(
+            v, static_props, (*path, k), strict=strict, shared=shared, is_async=is_async
+        )
+        base[k] = r if static else None  # to keep the order of the keys
+        if not static:
+            dynamic.append((k, r))
+        elif not shared and isinstance(r, (dict, list)):
+            copies.append(k)
+
+    if not dynamic:
+        return True, base
+    return False, __compile_container(base, dynamic, copies)
+
+
+def __compile_list(
+    l, static_props, path, *, strict: bool, shared: bool, is_async: bool
+):
+    base = []
+    dynamic = []
+    copies = []
+    for i, v in enumerate(l):
+        static, r = __compile(
+            v, static_props, (*path, v), strict=strict, shared=shared, is_async=is_async
+        )
+        base.append(r if static else None)
+        if not static:
+            dynamic.append((i, r))
+        elif not shared and isinstance(r, (dict, list)):
+            copies.append(i)
+
+    if not dynamic:
+        return True, base
+    return False, __compile_container(base, dynamic, copies)
+
+
+def __compile_container(base: dict | list, dynamic: list, copies: list) -> Callable:
+    """
+    The container is rendered by filling the dynamic slots (dict keys or list
+    indexes) of a copy of base. Slots that need to be awaited, are awaited
+    concurrently.
+    """
+    awaiting = [(i, f) for i, f in dynamic if inspect.iscoroutinefunction(f)]
+    dynamic = [(i, f) for i, f in dynamic if not inspect.iscoroutinefunction(f)]
+
+    def render_container(props):
+        r = base.copy()
+        for i in copies:
+            r[i] = __copy(r[i])
+        for i, f in dynamic:
+            r[i] = f(props)
+        return r
+
+    if not awaiting:
+        return render_container
+
+    async def render_container_async(props):
+        r = render_container(props)
+        results = await asyncio.gather(*(f(props) for _, f in awaiting))
+        for (i, _), result in zip(awaiting, results):
+            r[i] = result
+        return r
+
+    return render_container_async
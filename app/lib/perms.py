@@ -2,87 +2,226 @@
 Raises: []
 """
 
+import enum
 import logging
+from functools import lru_cache
+from typing import Iterable
 
 from app.model import spc
 from app.model import inp
+from app.model.out import Permission
 from app.lib import props
 from app.lib import j2
 
 logger = logging.getLogger(__name__)
 
+# Props that differ between the entities of a request (see props.get_roles)
+DATA_PROPS = frozenset(("old", "new"))
+
+
+class Perm(enum.IntFlag):
+    """
+    Compact representation of the reserved permissions (see out.Permission),
+    custom permissions (defined in the specs) can not be represented.
+    """
+
+    READ = enum.auto()
+    CREATE = enum.auto()
+    RENAME = enum.auto()
+    COPY = enum.auto()
+    LINK = enum.auto()
+    EDIT = enum.auto()
+    CLEANUP = enum.auto()
+    DELETE = enum.auto()
+    RUNACTION = enum.auto()
+    ADMINISTER = enum.auto()
+
+
+# What each perm used in roles expands to (see docs/perms.md)
+EXPANSIONS: dict[str, Perm] = {
+    "see": Perm.READ,
+    "add": Perm.READ | Perm.CREATE,
+    "rnm": Perm.READ | Perm.RENAME,
+    "cpy": Perm.READ | Perm.COPY,
+    "lnk": Perm.READ | Perm.LINK,
+    "edt": Perm.READ | Perm.EDIT,
+    "cln": Perm.READ | Perm.CLEANUP,
+    "del": Perm.DELETE,
+    "act": Perm.RUNACTION,
+    "all": ~Perm.ADMINISTER,
+    "adm": ~Perm(0),
+}
+
+# The sorted list of perm names of every combination of perms
+__NAMES: list[list[str]] = [
+    sorted(Permission[p.name].value for p in Perm if p & flags)
+    for flags in range(2 ** len(Perm))
+]
+
+
+def to_names(flags: Perm, other: Iterable[str] = ()) -> list[str]:
+    if not other:
+        return list(__NAMES[flags])
+    return sorted(set(__NAMES[flags]).union(other))
+
+
+@lru_cache(maxsize=1024)
+def parse(perms: tuple[str, ...]) -> tuple[Perm, frozenset[str]]:
+    """
+    Returns the reserved perms as Perm and the custom perms as they are.
+    """
+    flags = Perm(0)
+    other = set()
+    for p in perms:
+        try:
+            flags |= Perm[Permission(p).name]
+        except ValueError:
+            other.add(p)
+    return flags, frozenset(other)
+
+
+def has_all(perms: list[str] | None, required: Iterable[str]) -> bool:
+    flags, other = parse(tuple(perms or ()))
+    rflags, rother = parse(tuple(required))
+    return flags & rflags == rflags and rother.issubset(other)
+
+
+def has_any(perms: list[str] | None, required: Iterable[str]) -> bool:
+    flags, other = parse(tuple(perms or ()))
+    rflags, rother = parse(tuple(required))
+    return bool(flags & rflags) or not rother.isdisjoint(other)
+
 
 def __expand_perms(p: list[str]) -> list[str]:
-    res = []
-    _ = [res.extend(q.split("+")) for q in p]
-
-    result = []
-    for r in res:
-        if r == "all":
-            result.extend(
-                ["see", "add", "rnm", "cpy", "lnk", "edt", "cln", "del", "act"]
-            )
-        elif r == "adm":
-            result.extend(
-                ["see", "add", "rnm", "cpy", "lnk", "edt", "cln", "del", "act", "adm"]
-            )
-        elif r == "cln":
-            result.extend(["see", "cln"])
-        elif r == "edt":
-            result.extend(["see", "edt"])
-        elif r == "lnk":
-            result.extend(["see", "lnk"])
-        elif r == "cpy":
-            result.extend(["see", "cpy"])
-        elif r == "rnm":
-            result.extend(["see", "rnm"])
-        elif r == "add":
-            result.extend(["see", "add"])
-        else:
-            result.append(r)
-
-    return sorted(list(set(result)))
-
-
-def get_from_roles(
-    op: inp.OperationRequest, specs: spc.Specs, old_data: dict, new_name: bool = False
+    flags = Perm(0)
+    other = set()
+    for q in p:
+        for r in q.split("+"):
+            if r in EXPANSIONS:
+                flags |= EXPANSIONS[r]
+            else:
+                other.add(r)
+    return to_names(flags, other)
+
+
+async def __render_tests(
+    tests: list, role_props: dict, memo: dict | None
+) -> list[bool | j2.J2Error]:
+    results = [memo.get(str(t)) if memo is not None else None for t in tests]
+    pending = [i for i, r in enumerate(results) if r is None]
+    rendered = await j2.render_tests_async([tests[i] for i in pending], role_props)
+    for i, r in zip(pending, rendered):
+        results[i] = r
+        if memo is not None and not __depends_on_data(tests[i]):
+            memo[str(tests[i])] = r
+    return results
+
+
+def __depends_on_data(test) -> bool:
+    references = j2.get_references(f"{{{{ {test} }}}}")
+    return references is None or not references.isdisjoint(DATA_PROPS)
+
+
+def index_roles(roles: list) -> dict[str, dict]:
+    """
+    Indexes the role definitions by the type they apply to (and the entity name
+    for roles of single entities), so get_from_roles only needs to render the
+    tests of the roles that can apply. This only depends on the specs, so it is
+    done once per specs document (see app.lib.specs).
+    """
+    index = {}
+    for role in roles if isinstance(roles, list) else []:
+        try:
+            role = dict(role)
+        except (TypeError, ValueError):
+            continue  # fails when validating the specs
+        for role_def, role_test in role.items():
+            if not isinstance(role_def, str):
+                continue
+            parts = role_def.split(":")
+            type_names = {parts[0]}
+            if parts[0] in ("all", "set") and len(parts) > 1:
+                type_names.add(parts[1])
+            for type_name in type_names:
+                entry = index.setdefault(type_name, {"all": [], "set": [], "names": {}})
+                __index_role(entry, type_name, role_def, role_test)
+    return index
+
+
+def __index_role(entry: dict, type_name: str, role_def: str, role_test) -> None:
+    if role_def.startswith(f"all:{type_name}:"):
+        entry["all"].append((role_def, role_test, role_def.split(":", 2)[2]))
+    elif role_def.startswith(f"set:{type_name}:"):
+        try:
+            _, _, set_name, perm = role_def.split(":", 3)
+        except ValueError:
+            logger.error(f"Role {role_def} is missing a permission")
+            return
+        entry["set"].append((role_def, role_test, (set_name, perm)))
+    elif role_def.startswith(f"{type_name}:") and role_def.count(":") >= 2:
+        _, name, perm = role_def.split(":", 2)
+        entry["names"].setdefault(name, []).append((role_def, role_test, perm))
+
+
+async def get_from_roles(
+    op: inp.OperationRequest,
+    specs: spc.Specs,
+    old_data: dict,
+    new_name: bool = False,
+    *,
+    memo: dict | None = None,
 ) -> list[str]:
     """
     Reads the role definitions from specs and renders them with given data and
     request context. If they match, the perms are returned if the role
     definition also matches (including set definition for sets).
+
+    Only the roles for this type (and entity name) are rendered (see
+    index_roles), all of them (and then all set tests needed) concurrently, see
+    j2.render_tests_async.
+
+    The results of tests not referring to DATA_PROPS are stored in memo, so
+    they are only rendered once per request if memo is passed for every entity
+    of the same request.
     """
     name = getattr(op.entity, "name", None) if new_name else op.name
+    index = specs.roles_index
+    if index is None:
+        index = index_roles(specs.roles)
+    entry = index.get(op.type_name, {})
+    roles = [("all", r) for r in entry.get("all", [])]
+    roles.extend(("set", r) for r in entry.get("set", []))
+    if name is not None:
+        roles.extend(("name", r) for r in entry.get("names", {}).get(name, []))
     role_props = props.get_roles(op, specs.request, old_data)
+    rtests = await __render_tests([r[1] for _, r in roles], role_props, memo)
+
     perms = []
-    for role in specs.roles:
-        for role_def, role_test in dict(role).items():
-            try:
-                rtest = j2.render_test(role_test, role_props)
-            except j2.J2Error as error:
-                logger.error(f"Role {role_def} could not be rendered: {error}")
-                rtest = False
-            if rtest:
-                logger.debug(f"Extracting perms from role {role_def}")
-                if role_def.startswith(f"all:{op.type_name}:"):
-                    perms.append(role_def.split(":", 2)[2])
-                elif role_def.startswith(f"set:{op.type_name}:"):
-                    _, _, set_name, perm = role_def.split(":", 3)
-                    set_test = getattr(specs.sets, op.type_name, {}).get(
-                        set_name, "false"
-                    )
-                    try:
-                        stest = j2.render_test(set_test, role_props)
-                    except j2.J2Error as error:
-                        logger.error(
-                            f"Set {op.type_name}.{set_name} could not be rendered: {error}"
-                        )
-                        stest = False
-                    if stest:
-                        perms.append(perm)
-                elif name is not None and role_def.startswith(
-                    f"{op.type_name}:{name}:"
-                ):
-                    perms.append(role_def.split(":", 2)[2])
+    sets = {}
+    for (kind, (role_def, _, perm)), rtest in zip(roles, rtests):
+        if isinstance(rtest, j2.J2Error):
+            logger.error(f"Role {role_def} could not be rendered: {rtest}")
+            rtest = False
+        if rtest:
+            logger.debug(f"Extracting perms from role {role_def}")
+            if kind == "set":
+                set_name, perm = perm
+                sets.setdefault(set_name, []).append(perm)
+            else:
+                perms.append(perm)
+
+    set_tests = [
+        getattr(specs.sets, op.type_name, {}).get(set_name, "false")
+        for set_name in sets
+    ]
+    stests = await __render_tests(set_tests, role_props, memo)
+    for (set_name, set_perms), stest in zip(sets.items(), stests):
+        if isinstance(stest, j2.J2Error):
+            logger.error(
+                f"Set {op.type_name}.{set_name} could not be rendered: {stest}"
+            )
+            stest = False
+        if stest:
+            perms.extend(set_perms)
     logger.debug(f'Extracted perms: {", ".join(perms)}')
     return __expand_perms(perms)
@@ -2,11 +2,17 @@
 Raises: [app.model.err.PluginError]
 """
 
+import copy
+import functools
 import glob
 import logging
 import pydoc
+import threading
+import time
+from collections import OrderedDict
 from types import ModuleType
 from types import FunctionType
+from typing import NamedTuple
 from pathlib import Path
 from functools import cmp_to_key
 from functools import lru_cache
@@ -17,6 +23,18 @@ from app.model.err import PluginError
 logger = logging.getLogger(__name__)
 
 
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+    ttl: float
+
+
+# All functions decorated with cached() by their qualified name
+__cached: dict[str, FunctionType] = {}
+
+
 @lru_cache(maxsize=None)
 def get_functions(kind: str) -> dict[str, FunctionType]:
     functions = {}
@@ -38,6 +56,93 @@ def get_functions(kind: str) -> dict[str, FunctionType]:
     return functions
 
 
+def blocking(function: FunctionType) -> FunctionType:
+    """
+    Decorator for j2_functions, j2_filters and j2_tests plugin functions that
+    block (e.g. network I/O), so they are run in a separate thread when
+    rendering asynchronously (see app.lib.j2).
+    """
+    function.yac_blocking = True
+    return function
+
+
+def is_blocking(function: FunctionType) -> bool:
+    return getattr(function, "yac_blocking", False)
+
+
+def cached(*, ttl: float = 300.0, maxsize: int = 1024):
+    """
+    Decorator for j2_functions, j2_filters and j2_tests plugin functions that
+    always return the same for the same arguments (at least for ttl seconds),
+    so their results are memoized per arguments (for at most maxsize different
+    arguments). Exceptions are never memoized.
+
+    Unlike functools.lru_cache, arguments may be lists or dicts and results are
+    copied, so they can be modified by the caller.
+    """
+
+    def decorator(function: FunctionType) -> FunctionType:
+        entries: OrderedDict = OrderedDict()
+        stats = {"hits": 0, "misses": 0}
+        lock = threading.Lock()
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            try:
+                key = __freeze((args, kwargs))
+            except Exception:  # pylint: disable=broad-exception-caught
+                # e.g. unhashable or undefined (jinja2) arguments
+                return function(*args, **kwargs)
+            now = time.monotonic()
+            with lock:
+                if key in entries and entries[key][0] > now:
+                    entries.move_to_end(key)
+                    stats["hits"] += 1
+                    return copy.deepcopy(entries[key][1])
+                stats["misses"] += 1
+            result = function(*args, **kwargs)
+            with lock:
+                entries[key] = (time.monotonic() + ttl, result)
+                entries.move_to_end(key)
+                while len(entries) > maxsize:
+                    entries.popitem(last=False)
+            return copy.deepcopy(result)
+
+        def cache_info() -> CacheInfo:
+            with lock:
+                return CacheInfo(
+                    stats["hits"], stats["misses"], maxsize, len(entries), ttl
+                )
+
+        def cache_clear() -> None:
+            with lock:
+                entries.clear()
+                stats.update({"hits": 0, "misses": 0})
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        __cached[f"{function.__module__}.{function.__qualname__}"] = wrapper
+        return wrapper
+
+    return decorator
+
+
+def cache_info() -> dict[str, CacheInfo]:
+    """
+    Statistics of all functions decorated with cached() by their qualified name.
+    """
+    return {name: f.cache_info() for name, f in __cached.items()}
+
+
+def __freeze(o):
+    if isinstance(o, dict):
+        return ("dict", *((k, __freeze(v)) for k, v in sorted(o.items())))
+    if isinstance(o, (list, tuple)):
+        return (type(o).__name__, *(__freeze(v) for v in o))
+    hash(o)
+    return o
+
+
 @lru_cache(maxsize=None)
 def get_modules(kind: str, require: tuple[str] | None = None) -> dict[str, ModuleType]:
     modules = {}
@@ -0,0 +1,127 @@
+"""
+Raises: [TimeoutError]
+"""
+
+import logging
+import threading
+import time
+from abc import ABC
+from abc import abstractmethod
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+
+class PoolInfo(NamedTuple):
+    size: int
+    idle: int
+    connects: int
+    discards: int
+
+
+class Pool(ABC):
+    """
+    A bounded, thread-safe pool of reusable connections (for plugins doing
+    network I/O, see plugin.blocking). Subclasses implement connect(), check()
+    (if an idle connection still works) and close().
+
+    At most size connections exist at any time, so callers wait (at most
+    timeout seconds) for a connection to be released. Connections idle for more
+    than check_interval seconds are checked before they are reused and replaced
+    if broken. A connection is discarded if any exception escapes while it is
+    used, so callers should handle the expected exceptions themselves.
+    """
+
+    def __init__(
+        self,
+        size: int = 4,
+        *,
+        timeout: float | None = None,
+        check_interval: float = 30.0,
+    ):
+        self.size = size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle: list[tuple[float, Any]] = []
+        self._connects = 0
+        self._discards = 0
+
+    @abstractmethod
+    def connect(self) -> Any: ...
+
+    @abstractmethod
+    def check(self, conn: Any) -> bool: ...
+
+    @abstractmethod
+    def close(self, conn: Any) -> None: ...
+
+    def info(self) -> PoolInfo:
+        with self._lock:
+            return PoolInfo(self.size, len(self._idle), self._connects, self._discards)
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No connection available within {self.timeout}s")
+        try:
+            conn = self.__acquire()
+            try:
+                yield conn
+            except BaseException:
+                self.__discard(conn)
+                raise
+            with self._lock:
+                self._idle.append((time.monotonic(), conn))
+        finally:
+            self._slots.release()
+
+    def call(
+        self,
+        f: Callable[[Any], Any],
+        *,
+        retry_on: tuple[type[BaseException], ...] = (),
+        retries: int = 1,
+    ) -> Any:
+        """
+        Calls f with a connection and retries with a new connection if one of
+        the exceptions in retry_on is raised (e.g. the server went away).
+        """
+        for attempt in range(retries + 1):
+            try:
+                with self.connection() as conn:
+                    return f(conn)
+            except retry_on as error:
+                if attempt == retries:
+                    raise error
+                logger.warning(f"Reconnecting after connection failed: {error}")
+        return None  # not reached
+
+    def __acquire(self) -> Any:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                released, conn = self._idle.pop()
+            if time.monotonic() - released < self.check_interval:
+                return conn
+            try:
+                if self.check(conn):
+                    return conn
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                logger.debug(f"Connection check failed: {error}")
+            self.__discard(conn)
+        conn = self.connect()
+        with self._lock:
+            self._connects += 1
+        return conn
+
+    def __discard(self, conn: Any) -> None:
+        with self._lock:
+            self._discards += 1
+        try:
+            self.close(conn)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            logger.debug(f"Closing connection failed: {error}")
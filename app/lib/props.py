@@ -26,6 +26,16 @@ def __request(request: Request, request_spec: spc.Request) -> dict:
     }
 
 
+def get_static() -> dict:
+    """
+    The subset of props that never changes while running, so everything only
+    depending on these can be rendered once in advance.
+    """
+    return {
+        "env": consts.ENV.env,
+    }
+
+
 def get_request() -> dict:
     return {
         "env": consts.ENV.env,
@@ -2,6 +2,8 @@
 Raises: [app.model.err.RepoError, app.model.err.RepoSpecsError]
 """
 
+import asyncio
+
 from app import consts
 from app.lib import j2
 from app.lib import perms
@@ -27,11 +29,15 @@ handler: Repo = repo_plugin.handler
 
 # TODO alru caching: from async_lru import alru_cache -> @alru_cache(maxsize=32, ttl=1)
 async def get_entities(
-    rpo: Repo, op: OperationRequest, specs: Specs
+    rpo: Repo, op: OperationRequest, specs: Specs, *, memo: dict | None = None
 ) -> tuple[Entity, Entity]:
     """
     Try to collect data about the entity refered in this OperationRequest.
     Should not fail even if the provided data is nonsense.
+
+    Pass the same memo (an empty dict at first) for all entities of a request to
+    render the role tests not depending on the entity only once (see
+    perms.get_from_roles).
     """
     old = Entity()
     new = Entity()
@@ -54,6 +60,7 @@ async def get_entities(
                 old.exists = True
                 old.is_link = await rpo.is_link(old.name)
                 old.link = await rpo.get_link(old.name) if old.is_link else None
+                old.linked_by = await rpo.get_linked_by(old.name)
                 old.yaml = await rpo.get(old.name)
         if new.name is not None:
             if await rpo.exists(new.name):
@@ -68,9 +75,12 @@ async def get_entities(
                 f"Failed to parse YAML of {op.type_name} {old.name}: {error}"
             ) from error
 
-    old.perms = perms.get_from_roles(op, specs, old.data or {}, new_name=False)
     # we only use old data to render the perms!
-    new.perms = perms.get_from_roles(op, specs, old.data or {}, new_name=True)
+    memo = {} if memo is None else memo
+    old.perms, new.perms = await asyncio.gather(
+        perms.get_from_roles(op, specs, old.data or {}, new_name=False, memo=memo),
+        perms.get_from_roles(op, specs, old.data or {}, new_name=True, memo=memo),
+    )
 
     return old, new
 
@@ -89,6 +99,7 @@ def to_detailed_entity(
         options=options,
         data=entity.data,
         yaml=entity.yaml,
+        linked_by=entity.linked_by or [],
         perms=entity.perms,
         hash=entity_hash,
     )
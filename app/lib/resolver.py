@@ -0,0 +1,125 @@
+"""
+Raises: [OSError]
+"""
+
+import logging
+import math
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Iterable
+
+from app import consts
+
+logger = logging.getLogger(__name__)
+
+
+class Resolver:
+    """
+    Resolves hostnames and addresses with a cache for positive and negative
+    answers (failed lookups raise a new error of the same type with the same
+    arguments until it expires, as an error is not safe to share between
+    threads). The DNS-backed plugin functions rely on these TTLs, so they must
+    not be memoized again (see plugin.cached).
+    All lookups run in the threads of the resolver (at most concurrency for all
+    callers together), multiple lookups are resolved concurrently and callers
+    missing the same key at the same time wait for the same lookup.
+
+    The lookup functions can be replaced by stubs (for testing).
+    """
+
+    def __init__(
+        self,
+        *,
+        concurrency: int = 32,
+        ttl: float = 300.0,
+        negative_ttl: float = 60.0,
+        maxsize: int = 4096,
+        gethostbyaddr: Callable[[str], tuple] = socket.gethostbyaddr,
+        gethostbyname: Callable[[str], str] = socket.gethostbyname,
+    ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+        self._lookups = {"addr": gethostbyaddr, "name": gethostbyname}
+        self._executor = ThreadPoolExecutor(concurrency, thread_name_prefix="dns")
+        self._lock = threading.Lock()
+        self._cache: OrderedDict = OrderedDict()
+
+    def to_fqhn(self, ip: str) -> str:
+        return self.__result(self.__submit("addr", str(ip)))
+
+    def to_ip(self, hostname: str) -> str:
+        return self.__result(self.__submit("name", hostname))
+
+    def to_fqhns(self, ips: Iterable) -> list[str]:
+        """
+        Raises the error of the first address (in order) that failed.
+        """
+        futures = [self.__submit("addr", str(ip)) for ip in ips]
+        return [self.__result(future) for future in futures]
+
+    def cache_clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def __submit(self, kind: str, key: str) -> Future:
+        """
+        Returns the cached (or pending) lookup or starts a new one, which is
+        cached until it is done and then for the TTL of its answer.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get((kind, key))
+            if entry is not None and entry[0] > now:
+                self._cache.move_to_end((kind, key))
+                return entry[1]
+            future = self._executor.submit(self.__lookup, kind, key)
+            self.__set((kind, key), math.inf, future)
+        future.add_done_callback(partial(self.__expire, (kind, key)))
+        return future
+
+    def __lookup(self, kind: str, key: str) -> tuple:
+        try:
+            result = self._lookups[kind](key)
+        except OSError as error:
+            logger.debug(f"Failed to resolve {key}: {error}")
+            return None, (type(error), error.args)
+        if kind == "addr":
+            result = result[0]
+        return result, None
+
+    @staticmethod
+    def __result(future: Future) -> str:
+        result, error = future.result()
+        if error is not None:
+            error_type, args = error
+            raise error_type(*args)
+        return result
+
+    def __expire(self, key: tuple, future: Future) -> None:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry[1] is not future:
+                return  # evicted or cleared in the meantime
+            if future.cancelled() or future.exception() is not None:
+                del self._cache[key]  # unexpected errors are not cached
+                return
+            ttl = self.ttl if future.result()[1] is None else self.negative_ttl
+            self._cache[key] = (time.monotonic() + ttl, future)
+
+    def __set(self, key: tuple, expires: float, future: Future) -> None:
+        self._cache[key] = (expires, future)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+
+RESOLVER = Resolver(
+    concurrency=consts.ENV.dns_concurrency,
+    ttl=consts.ENV.dns_ttl,
+    negative_ttl=consts.ENV.dns_negative_ttl,
+)
@@ -3,6 +3,7 @@ Raises: [app.model.err.SchemaSpecsError]
 """
 
 import logging
+from typing import Any, Callable
 
 import jsonschema
 
@@ -20,14 +21,20 @@ from app.model.err import SchemaSpecsError
 logger = logging.getLogger(__name__)
 
 
-def get(
+async def get(
     op: inp.OperationRequest,
     schema_spec: spc.Schema,
     request_spec: spc.Request,
     old_data: dict,
     old_perms: list[str],
     new_data: dict,
+    *,
+    render: Callable[[dict], Any] | None = None,
 ) -> out.Schema:
+    """
+    Use render (see j2.prerender with is_async) to render schema_spec, if it is
+    available.
+    """
     schema_props = props.get_schema(op, request_spec, old_data, old_perms, new_data)
 
     if (
@@ -40,7 +47,10 @@ def get(
         schema_props["old"]["perms"].append("add")
 
     try:
-        json_schema = j2.render(dict(schema_spec), schema_props)
+        if render is None:
+            json_schema = await j2.render_async(dict(schema_spec), schema_props)
+        else:
+            json_schema = await render(schema_props)
     except j2.J2Error as error:
         raise SchemaSpecsError(f"{error.loc}: {error}") from error
 
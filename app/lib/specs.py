@@ -3,15 +3,19 @@ Raises: [app.model.err.SpecsError]
 """
 
 import logging
-from functools import lru_cache
+import time
+from typing import Any, Awaitable, Callable, NamedTuple
 
 from pydantic import ValidationError
 from anyio import Path, open_file
 
 from app import consts
 from app.lib import j2
+from app.lib import perms
+from app.lib import plugin
 from app.lib import props
 from app.lib import yaml
+from app.model.err import PluginError
 from app.model.err import RepoError
 from app.model.err import SpecsError
 from app.model.rpo import Repo
@@ -21,30 +25,95 @@ from app.model.inp import OperationRequest
 
 logger = logging.getLogger(__name__)
 
-# TODO add (async) way to cache specs
 # TODO check major version of specs (must match!)
 
 
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    key: str | None
+
+
+# The compiled specs document (see __compile) of the current repo commit (or the
+# current version of the specs file), shared by all requests of this worker.
+__cache: dict = {"key": None, "specs": None, "checked": 0.0, "hits": 0, "misses": 0}
+
+
 def in_repo() -> bool:
     return consts.ENV.specs.startswith(".")
 
 
-async def read_from_repo(rpo: Repo, op: OperationRequest) -> Specs:
+def cache_info() -> CacheInfo:
+    return CacheInfo(__cache["hits"], __cache["misses"], __cache["key"])
+
+
+async def read_from_repo(
+    rpo: Repo, op: OperationRequest, *, all_types: bool = False
+) -> Specs:
     try:
-        data = await rpo.get_specs(consts.ENV.specs)
+        key = await rpo.get_hash()
+        compiled = __get_cached(key)
+        if compiled is None:
+            compiled = __set_cached(
+                key, __compile(__load(await rpo.get_specs(consts.ENV.specs)))
+            )
     except RepoError as error:
         raise SpecsError(
             f"Could not read specs from repo at {consts.ENV.specs}"
         ) from error
-    return __parse(data, op)
-
-
-async def read_from_file(op: OperationRequest) -> Specs:
-    return __parse(await __read_file(), op)
+    return await __parse(compiled, op, all_types=all_types)
+
+
+async def read_from_file(op: OperationRequest, *, all_types: bool = False) -> Specs:
+    """
+    The file is only checked for changes (by its inode, mtime and size) if it
+    was not checked within the last specs_file_check_interval seconds, so a
+    replaced file (e.g. a mounted ConfigMap) is picked up without a restart.
+    If the changed file can not be compiled, the specs compiled before are
+    dropped, so it is checked (and fails) again until it is fixed.
+    """
+    key = __cache["key"]
+    if key is None or (
+        time.monotonic() - __cache["checked"] >= consts.ENV.specs_file_check_interval
+    ):
+        key = await __stat_file()
+        __cache["checked"] = time.monotonic()
+    compiled = __get_cached(key)
+    if compiled is None:
+        try:
+            compiled = __set_cached(key, __compile(__load(await __read_file())))
+        except SpecsError:
+            __cache.update({"key": None, "specs": None})
+            raise
+    return await __parse(compiled, op, all_types=all_types)
+
+
+def __get_cached(key: str) -> dict | None:
+    if key and key == __cache["key"]:
+        __cache["hits"] += 1
+        return __cache["specs"]
+    __cache["misses"] += 1
+    return None
+
+
+def __set_cached(key: str, compiled: dict) -> dict:
+    if key:
+        logger.debug(f"Caching compiled specs of {key}")
+        __cache.update({"key": key, "specs": compiled})
+    return compiled
+
+
+async def __stat_file() -> str:
+    try:
+        stat = await Path(consts.ENV.specs).stat()
+    except OSError as error:
+        raise SpecsError(
+            f"Could not read specs from file at {consts.ENV.specs}"
+        ) from error
+    return f"file:{stat.st_ino}:{stat.st_mtime_ns}:{stat.st_size}"
 
 
-@lru_cache(maxsize=1)
-async def __read_file():
+async def __read_file() -> str:
     try:
         async with await open_file(
             consts.ENV.specs, mode="r", encoding="utf-8"
@@ -57,30 +126,127 @@ async def __read_file():
         ) from error
 
 
-def __parse(specs: str, op: OperationRequest) -> Specs:
+def __load(specs: str) -> dict:
     try:
-        data = yaml.load_as_dict(specs, strict=False)
+        return yaml.load_as_dict(specs, strict=False)
     except yaml.YAMLError as error:
         raise SpecsError(f"In YAML syntax: {error}") from error
 
+
+def __compile(data: dict) -> dict:
+    """
+    Does all the work that does not depend on the request, so it only needs to
+    be done once per specs document: The request spec only depends on static
+    props and is rendered completely, each type is prerendered as far as
+    possible (see j2.prerender) on its own, so it can be rendered on its own.
+    The same goes for the schema, which needs to be rendered by schema.get, and
+    the roles are indexed by type (see perms.index_roles).
+    """
     try:
-        data["request"] = j2.render(
-            data.get("request", {"headers": {}}), props.get_request()
+        request = Request.model_validate(
+            j2.render(data.get("request", {"headers": {}}), props.get_request())
         )
-        request = Request.model_validate(data["request"])
     except j2.J2Error as error:
         raise SpecsError(f"In request at {error.loc}: {error}") from error
     except ValidationError as error:
         raise SpecsError(f"In request: {error}") from error
 
+    types = []
+    for t in data.get("types", []):
+        try:
+            types.append((t, *__compile_type(t)))
+        except j2.J2Error as error:
+            error.loc = f"{error.loc}/{t}"
+            raise SpecsError(f"In types at {error.loc}: {error}") from error
+
     try:
-        # TODO skip rendering log and action details to allow handling within the plugins
-        data["types"] = j2.render(data.get("types", []), props.get_types(op, request))
-        data["type"] = next(
-            (t for t in data["types"] if t.get("name", "") == op.type_name), None
+        schema = j2.prerender(
+            data.get("schema", {}), props.get_static(), is_async=True
         )
-    except j2.J2Error as error:
-        raise SpecsError(f"In types at {error.loc}: {error}") from error
+    except j2.J2Error:
+        schema = None  # fails again when rendering it in schema.get
+
+    return {
+        "data": data,
+        "request": request,
+        "types": types,
+        "schema": schema,
+        "roles": perms.index_roles(data.get("roles", [])),
+    }
+
+
+def __compile_type(
+    t: Any,
+) -> tuple[Callable[[dict], Awaitable[Any]], Callable[[dict], Awaitable[Any]]]:
+    """
+    Returns the prerendered name and the prerendered type (both rendered
+    asynchronously). The details of logs and actions are left as they are if
+    the plugin renders them on its own (by defining RAW_DETAILS = True).
+    """
+    if not isinstance(t, dict):
+        return j2.prerender(None, is_async=True), j2.prerender(t, is_async=True)
+
+    t = dict(t)
+    raw = []
+    for key, kind in (("logs", "log"), ("actions", "action")):
+        if not isinstance(t.get(key), list):
+            continue
+        t[key] = [dict(e) if isinstance(e, dict) else e for e in t[key]]
+        for i, e in enumerate(t[key]):
+            if isinstance(e, dict) and "details" in e and __raw_details(kind, e):
+                raw.append((key, i, e.pop("details")))
+
+    static_props = props.get_static()
+    name = j2.prerender(t.get("name", ""), static_props, is_async=True)
+    # Types are copied when validating them, so no need to do it here already
+    render = j2.prerender(t, static_props, shared=True, is_async=True)
+
+    async def render_type(type_props: dict) -> Any:
+        r = dict(await render(type_props))
+        for key, i, details in raw:
+            r[key] = list(r[key])
+            r[key][i] = {**r[key][i], "details": details}
+        return r
+
+    return name, render_type if raw else render
+
+
+def __raw_details(kind: str, spec: dict) -> bool:
+    if not isinstance(spec.get("plugin"), str):
+        return False
+    try:
+        return getattr(plugin.get_module(kind, spec["plugin"]), "RAW_DETAILS", False)
+    except PluginError:
+        return False  # fails later on when the plugin is used
+
+
+async def __parse(compiled: dict, op: OperationRequest, *, all_types: bool) -> Specs:
+    """
+    Only renders the type of this op, unless all_types is set (so types will
+    only contain this one type otherwise).
+    """
+    # The parsed document may be cached, so only ever replace its top-level keys
+    # in a copy and never modify it in place.
+    data = dict(compiled["data"])
+    data["request"] = compiled["request"]
+    data["json_schema_render"] = compiled["schema"]
+    data["roles_index"] = compiled["roles"]
+    type_props = props.get_types(op, compiled["request"])
+
+    data["types"] = []
+    data["type"] = None
+    for spec, name, render in compiled["types"]:
+        try:
+            if not all_types and await name(type_props) != op.type_name:
+                continue
+            t = await render(type_props)
+        except j2.J2Error as error:
+            error.loc = f"{error.loc}/{spec}"
+            raise SpecsError(f"In types at {error.loc}: {error}") from error
+        data["types"].append(t)
+        if data["type"] is None and isinstance(t, dict):
+            if t.get("name", "") == op.type_name:
+                data["type"] = t
 
     try:
         return Specs.model_validate(data)
@@ -127,6 +127,10 @@ class DetailedEntity(ListedEntity):
         ),
     ] = {}
     yaml: Annotated[str | None, Field(description="The raw YAML data")] = None
+    linked_by: Annotated[
+        list[str],
+        Field(description="Names of the entities that are linked to this one"),
+    ] = []
     hash: Annotated[str, Field(description=consts.DESC_HASH)]
 
 
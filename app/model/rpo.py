@@ -29,6 +29,9 @@ class Repo:
     @abstractmethod
     async def get_hash(self) -> str: ...
 
+    @abstractmethod
+    async def get_linked_by(self, name: str) -> list[str]: ...
+
     @abstractmethod
     async def list(self) -> list[str]: ...
 
@@ -72,6 +75,7 @@ class Entity(BaseModel):
     exists: None | bool = None
     is_link: None | bool = None
     link: None | str = None
+    linked_by: None | list[str] = None
     yaml: None | str = None
     data: None | dict = None
     perms: None | list[Permission | str] = None
@@ -1,3 +1,5 @@
+from typing import Any, Awaitable, Callable
+
 from pydantic import BaseModel, Field
 from typing_extensions import Annotated
 from pydantic.config import Extra
@@ -50,3 +52,11 @@ class Specs(BaseModel):
     roles: list[Role] = []
     sets: Sets = Sets()
     json_schema: Annotated[Schema, Field(alias="schema")]
+    # Prepared once per specs document by app.lib.specs to render json_schema
+    # faster (see app.lib.j2.prerender with is_async)
+    json_schema_render: Annotated[
+        Callable[[dict], Awaitable[Any]] | None, Field(exclude=True)
+    ] = None
+    # Prepared once per specs document by app.lib.specs to only render the roles
+    # that can apply (see app.lib.perms.index_roles)
+    roles_index: Annotated[dict | None, Field(exclude=True)] = None
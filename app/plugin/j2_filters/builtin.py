@@ -1,7 +1,8 @@
 import datetime
 import re
-import socket
 
+from app.lib import plugin
+from app.lib.resolver import RESOLVER
 from app.model.err import RequestError
 
 
@@ -17,8 +18,9 @@ def to_datetime(string, format="%Y-%m-%d %H:%M:%S"):
     return datetime.datetime.strptime(string, format)
 
 
+@plugin.blocking
 def to_fqhn(ip: str) -> str:
-    return socket.gethostbyaddr(str(ip))[0]
+    return RESOLVER.to_fqhn(ip)
 
 
 def regex_replace(value: str = "", pattern: str = "", replacement: str = "") -> str:
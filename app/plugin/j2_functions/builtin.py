@@ -1,13 +1,16 @@
 import datetime
 import re
-import socket
 import uuid
 
 import ipaddress
 
+from app.lib import plugin
+from app.lib.resolver import RESOLVER
 
+
+@plugin.blocking
 def ip4net_to_fqhn(subnet: str) -> list[str]:
-    return [socket.gethostbyaddr(str(ip))[0] for ip in ipaddress.IPv4Network(subnet)]
+    return RESOLVER.to_fqhns(ipaddress.IPv4Network(subnet))
 
 
 def regex_replace(value: str = "", pattern: str = "", replacement: str = "") -> str:
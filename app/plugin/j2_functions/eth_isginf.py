@@ -11,6 +11,14 @@ Environment variables:
                                  example: 'cn=user,ou=admins,o=example,c=com'
   YAC_ISGINF_LDAPSEARCH_BIND_PW: Bind password
                                  default: '' -> required!
+  YAC_ISGINF_LDAPSEARCH_POOL:    Max. number of (bound) connections kept open
+                                 default: 4
+  YAC_ISGINF_LDAPSEARCH_TTL:     Time (in seconds) to reuse the results of a
+                                 search. Fewer searches, but e.g. a user
+                                 removed from a group keeps the permissions
+                                 given by it for up to this long. 0 disables
+                                 it.
+                                 default: 300
 """
 
 import ldap
@@ -18,9 +26,43 @@ import logging
 import os
 import re
 
+from app.lib import plugin
+from app.lib import pool
+
 logger = logging.getLogger(__name__)
 
 
+class LdapPool(pool.Pool):
+    def __init__(self, cert_check: bool):
+        super().__init__(int(os.environ.get("YAC_ISGINF_LDAPSEARCH_POOL", "4")))
+        self.cert_check = cert_check
+
+    def connect(self):
+        # pylint: disable=no-member
+        c = ldap.initialize(os.environ.get("YAC_ISGINF_LDAPSEARCH_URL"))
+        if not self.cert_check:
+            c.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
+            c.set_option(ldap.OPT_X_TLS_NEWCTX, 0)
+        c.simple_bind_s(
+            os.environ.get("YAC_ISGINF_LDAPSEARCH_BIND_DN"),
+            os.environ.get("YAC_ISGINF_LDAPSEARCH_BIND_PW"),
+        )
+        return c
+
+    def check(self, conn) -> bool:
+        conn.whoami_s()
+        return True
+
+    def close(self, conn):
+        conn.unbind_s()
+
+
+# One pool for connections with and one for those without cert checks
+POOLS = {True: LdapPool(True), False: LdapPool(False)}
+
+
+@plugin.blocking
+@plugin.cached(ttl=float(os.environ.get("YAC_ISGINF_LDAPSEARCH_TTL", "300")))
 def isginf_ldap_search(
     dn: str,
     filterstr: str = "(cn=*)",
@@ -36,29 +78,26 @@ def isginf_ldap_search(
         "subtree": ldap.SCOPE_SUBTREE,
     }
 
-    if not cert_check:
-        ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
-
-    c = ldap.initialize(os.environ.get("YAC_ISGINF_LDAPSEARCH_URL"))
-    c.simple_bind_s(
-        os.environ.get("YAC_ISGINF_LDAPSEARCH_BIND_DN"),
-        os.environ.get("YAC_ISGINF_LDAPSEARCH_BIND_PW"),
+    def search(c):
+        try:
+            return c.search_s(dn, scopes[scope], filterstr=filterstr, attrlist=[attr])
+        except ldap.NO_SUCH_OBJECT:
+            return []
+        except ldap.INVALID_DN_SYNTAX:
+            logger.warning(f"Invalid DN syntax in isginf_ldap_search: {dn}")
+            return []
+
+    results = POOLS[bool(cert_check)].call(
+        search, retry_on=(ldap.SERVER_DOWN, ldap.CONNECT_ERROR)
     )
 
-    try:
-        results = c.search_s(dn, scopes[scope], filterstr=filterstr, attrlist=[attr])
-    except ldap.NO_SUCH_OBJECT:
-        results = []
-    except ldap.INVALID_DN_SYNTAX:
-        logger.warning(f"Invalid DN syntax in isginf_ldap_search: {dn}")
-        results = []
-
     if attr == "dn":
         return [result[0] for result in results]
 
     return [result[1][attr][0].decode("utf-8") for result in results]
 
 
+@plugin.blocking
 def isginf_user_in_ou(user: str, ou: str) -> bool:
     return (
         len(
@@ -70,6 +109,7 @@ def isginf_user_in_ou(user: str, ou: str) -> bool:
     )
 
 
+@plugin.blocking
 def isginf_user_itc_in_ou(user: str, ou: str) -> bool:
     return (
         len(
@@ -82,6 +122,7 @@ def isginf_user_itc_in_ou(user: str, ou: str) -> bool:
     )
 
 
+@plugin.blocking
 def isginf_get_user_ous(user: str) -> list[str]:
     pattern = re.compile(f"^cn={user},ou=users,ou=([^,]+),ou=inf,ou=auth,o=ethz,c=ch$")
     ous = []
@@ -91,6 +132,7 @@ def isginf_get_user_ous(user: str) -> list[str]:
     return sorted(ous)
 
 
+@plugin.blocking
 def isginf_get_ou_users(ou: str, subou: str = "all") -> list[str]:
     if subou == "all":
         return isginf_ldap_search(f"ou=users,ou={ou},ou=inf,ou=auth,o=ethz,c=ch")
@@ -1,13 +1,16 @@
 import re
-import socket
 
 import netaddr
 
+from app.lib import plugin
+from app.lib.resolver import RESOLVER
 
+
+@plugin.blocking
 def host_in_ip4ranges(hostname: str | None, ipranges: list[str]) -> bool:
     if hostname is None:
         return False
-    return len(netaddr.all_matching_cidrs(socket.gethostbyname(hostname), ipranges)) > 0
+    return len(netaddr.all_matching_cidrs(RESOLVER.to_ip(hostname), ipranges)) > 0
 
 
 def regex_match(value: str | None, pattern: str) -> bool:
@@ -2,6 +2,7 @@ import logging
 
 from app.model.err import SchemaSpecsError
 from app.lib import locs
+from app.lib.perms import has_any
 
 logger = logging.getLogger(__name__)
 
@@ -44,14 +45,7 @@ def process(
         logger.warning(f"removed {loc} from schema due to undefined perms")
         return None, context
 
-    if (
-        len(
-            set(props["old"]["perms"]).intersection(
-                set(context["yac_perms"][perms_loc])
-            )
-        )
-        <= 0
-    ):
+    if not has_any(props["old"]["perms"], context["yac_perms"][perms_loc]):
         logger.info(
             f"removed {loc} from schema due to missing perms (requires one of: "
             f'{context["yac_perms"][perms_loc]})'
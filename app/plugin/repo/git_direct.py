@@ -2,7 +2,14 @@
 When using this plugin, every (worker) process will have its own repo copy in
 `/repo/{pid}` and every non-dirty access will cause an exclusive lock on the
 worker-repository to allow updating it before reading/writing. To optimize,
-mount a tmpfs at `/repo`, so all the data is always in memory.
+mount a tmpfs at `/repo`, so all the data is always in memory. To not store
+and fetch everything once per worker, set YAC_REPO__MIRROR. Listing and
+looking up entities is done in an index of the files at HEAD, which is updated
+whenever HEAD moves. Reads never use the checked out files, but the index at
+the time they started and the git objects, so they do not wait for writers
+(only for a fresh clone, if pulling fails). Writers only lock the files of the
+entities they change while checking them and take the writer lock to pull and
+to commit (and push), see GitRepo.lock_info for the time spent waiting.
 
 Details:
 
@@ -23,17 +30,67 @@ Environment variables:
                                   default: '/root/.ssh/known_hosts'
   YAC_REPO__DIRTY_MAX_AGE:        Acceptable age (in minutes) of the last git
                                   fetch where a dirty read will not update the
-                                  data again.
+                                  data again. Not used if
+                                  YAC_REPO__FETCH_INTERVAL is set.
                                   default: '0'
+  YAC_REPO__PROBE_TTL:            Time (in seconds) to reuse the commit of the
+                                  branch on the remote (see git ls-remote),
+                                  which is looked up before pulling, to not
+                                  pull if nothing changed. 0 disables it.
+                                  default: '1'
+  YAC_REPO__FETCH_INTERVAL:       Time (in seconds) between fetches in the
+                                  background. If set, reads (dirty or not) do
+                                  not pull anymore, but use what was fetched
+                                  last. 0 disables it.
+                                  default: '0'
+  YAC_REPO__MAX_STALENESS:        Acceptable age (in seconds) of the last
+                                  fetch for reads (if fetching in the
+                                  background). If it is older, a fetch is
+                                  started right away.
+                                  default: '60'
+  YAC_REPO__STRICT:               Let reads wait for that fetch (instead of
+                                  using the old data meanwhile).
+                                  default: 'false'
+  YAC_REPO__GROUP_COMMIT_WINDOW:  Time (in seconds) to collect writes before
+                                  pushing them together. Every write is still
+                                  checked and committed on its own (and sees
+                                  the commits before it), but is only pushed
+                                  with all others of the same window. Reads
+                                  only see them once pushed. A conflict (see
+                                  YAC_REPO__PUSH_RETRIES) only fails the write
+                                  concerned, any other push failure all of
+                                  them. 0 disables it.
+                                  default: '0'
+  YAC_REPO__MIRROR:               Path to a bare repo shared by all workers
+                                  (e.g. '/repo/mirror.git'). It is created on
+                                  first use and only it fetches from the
+                                  remote (one worker at a time, the others
+                                  use the result). The workers clone it with
+                                  --shared, so they only store their own
+                                  commits. It has the whole history of the
+                                  branch. '' disables it.
+                                  default: ''
+  YAC_REPO__PUSH_RETRIES:         How often to apply the commits onto the
+                                  remote branch again and push again if the
+                                  push is rejected, because the remote has new
+                                  commits. A commit is dropped (the write fails
+                                  with a conflict) if any of its files has been
+                                  changed remotely.
+                                  default: '3'
 """
 
+from bisect import insort
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from difflib import unified_diff
 from os import getpid
-from os.path import dirname
-from typing import Self, AsyncGenerator
+from typing import NamedTuple, Self, AsyncGenerator
 import asyncio
+import fcntl
 import logging
+import posixpath
+import random
+import re
 import time
 
 from aioshutil import rmtree
@@ -59,28 +116,362 @@ BRANCH = consts.ENV.repo.get("branch", "main")
 KEY_FILE = consts.ENV.repo.get("ssh_key_file", "/root/.ssh/id_rsa")
 KNOWN_HOSTS = consts.ENV.repo.get("ssh_known_hosts_file", "/root/.ssh/known_hosts")
 DIRTY_MAX = int(consts.ENV.repo.get("dirty_max_age", "0"))
+PROBE_TTL = float(consts.ENV.repo.get("probe_ttl", "1"))
+FETCH_INTERVAL = float(consts.ENV.repo.get("fetch_interval", "0"))
+MAX_STALENESS = float(consts.ENV.repo.get("max_staleness", "60"))
+STRICT = consts.ENV.repo.get("strict", "false").lower() == "true"
+GROUP_WINDOW = float(consts.ENV.repo.get("group_commit_window", "0"))
+MIRROR = consts.ENV.repo.get("mirror", "")
+PUSH_RETRIES = int(consts.ENV.repo.get("push_retries", "3"))
+PUSH_BACKOFF = 0.1  # seconds before the first retry, doubled for every retry
+# The index a reader started with (see GitRepo.reader)
+SNAPSHOT: ContextVar["Index | None"] = ContextVar("snapshot", default=None)
+# The git repo (with the user) and type details of the current request, as
+# requests are handled concurrently (see GitRepo.repo and GitRepo.fpath)
+REQUEST_REPO: ContextVar[git.Repo | None] = ContextVar("request_repo", default=None)
+REQUEST_FPATH: ContextVar[str] = ContextVar("request_fpath", default="")
+# The state of the writer of the current request (see GitRepo.writer)
+WRITE: ContextVar["Write | None"] = ContextVar("write", default=None)
+
+
+class LockInfo(NamedTuple):
+    count: int
+    wait_avg: float
+    wait_max: float
+
+
+class IndexEntry(NamedTuple):
+    obj: str
+    is_link: bool
+    # Normalized path (relative to the repo) the link points to, if it is a link
+    # pointing to a path within the repo
+    target: str | None = None
+
+
+class Index:
+    """
+    All files of the repo at a commit (see git ls-tree), so listing entities and
+    looking them up does not need any file system access. It is never modified,
+    updating it returns a new one (see git diff-tree).
+    """
+
+    def __init__(self, commit: str, entries: dict[str, IndexEntry]) -> None:
+        self.commit = commit
+        self.entries = entries
+        self._names: dict[str, list[str]] = {}
+        # The reverse index of links (see linked_by): the links resolving to
+        # each path, what each link resolves to and the paths its resolution
+        # went through and the links going through each path
+        self._links: dict[str, list[str]] | None = None
+        self._resolved: dict[str, tuple[str | None, frozenset[str]]] = {}
+        self._visitors: dict[str, frozenset[str]] = {}
+
+    @classmethod
+    async def build(cls, repo: git.Repo, commit: str) -> Self:
+        files = [
+            (path, mode, obj)
+            for mode, kind, obj, path in await repo.ls_tree(commit)
+            if kind == "blob"
+        ]
+        return cls(commit, await cls.__to_entries(repo, files))
+
+    async def update(self, repo: git.Repo, commit: str) -> Self:
+        entries = dict(self.entries)
+        files = []
+        changed = []
+        for status, mode, obj, path in await repo.diff_tree(self.commit, commit):
+            changed.append(path)
+            if status == "D" or mode == "160000":
+                entries.pop(path, None)
+            else:
+                files.append((path, mode, obj))
+        entries.update(await self.__to_entries(repo, files))
+        index = type(self)(commit, entries)
+        if self._links is not None:
+            index.__update_links(self, changed)
+        return index
+
+    @staticmethod
+    async def __to_entries(
+        repo: git.Repo, files: list[tuple[str, str, str]]
+    ) -> dict[str, IndexEntry]:
+        links = await repo.cat_blobs(
+            [obj for _, mode, obj in files if mode == "120000"]
+        )
+        entries = {}
+        for path, mode, obj in files:
+            if mode != "120000":
+                entries[path] = IndexEntry(obj, False)
+                continue
+            target = links[obj].decode("utf-8", errors="replace")
+            target = posixpath.normpath(posixpath.join(posixpath.dirname(path), target))
+            if target.startswith(("/", "../")) or target in (".", ".."):
+                target = None  # illegal destination
+            entries[path] = IndexEntry(obj, True, target)
+        return entries
+
+    def resolve(self, path: str, visited: set[str] | None = None) -> str | None:
+        """
+        Follows all links (also of parent directories) and returns the path of
+        the file or None if a link points to outside the repo (or loops). All
+        paths looked up on the way are added to visited.
+        """
+        parts = path.split("/")
+        resolved = []
+        hops = 0
+        while len(resolved) < len(parts):
+            current = "/".join(parts[: len(resolved) + 1])
+            if visited is not None:
+                visited.add(current)
+            entry = self.entries.get(current)
+            if entry is None or not entry.is_link:
+                resolved.append(parts[len(resolved)])
+                continue
+            hops += 1
+            if entry.target is None or hops > 40:
+                return None
+            parts = entry.target.split("/") + parts[len(resolved) + 1 :]
+            resolved = []
+        return "/".join(parts)
+
+    def exists(self, path: str) -> bool:
+        resolved = self.resolve(path)
+        return resolved is not None and resolved in self.entries
+
+    def is_link(self, path: str) -> bool:
+        """
+        If path is a link itself, after following the links of its parent
+        directories (like os.path.islink).
+        """
+        parent, _, name = path.rpartition("/")
+        if parent:
+            parent = self.resolve(parent)
+            if parent is None:
+                return False
+            path = f"{parent}/{name}"
+        entry = self.entries.get(path)
+        return entry is not None and entry.is_link
+
+    def linked_by(self, path: str) -> list[str]:
+        """
+        The sorted paths of all links (anywhere in the repo) resolving to path,
+        none if path is a link itself. The reverse index is built when first
+        used and then carried over by update.
+        """
+        if self._links is None:
+            self.__build_links()
+        if self.is_link(path):
+            return []
+        return self._links.get(path, [])
+
+    def __trace(self, link: str) -> tuple[str | None, frozenset[str]]:
+        visited: set[str] = set()
+        target = self.resolve(link, visited)
+        return target, frozenset(visited)
+
+    def __build_links(self) -> None:
+        links: dict[str, list[str]] = {}
+        visitors: dict[str, set[str]] = {}
+        for link, entry in self.entries.items():
+            if entry.is_link:
+                target, visited = self._resolved[link] = self.__trace(link)
+                if target is not None:
+                    links.setdefault(target, []).append(link)
+                for path in visited:
+                    visitors.setdefault(path, set()).add(link)
+        self._links = {target: sorted(l) for target, l in links.items()}
+        self._visitors = {path: frozenset(l) for path, l in visitors.items()}
+
+    def __update_links(self, old: "Index", changed: list[str]) -> None:
+        """
+        Takes over the reverse index of old and only resolves the links again,
+        which were changed or went through a changed path (e.g. a link to a
+        directory). The lists and sets of old are replaced, not modified.
+        """
+        links = dict(old._links or {})
+        resolved = dict(old._resolved)
+        visitors = dict(old._visitors)
+        affected = {link for path in changed for link in old._visitors.get(path, ())}
+        affected.update(
+            path
+            for path in changed
+            if path in self.entries and self.entries[path].is_link
+        )
+        for link in affected:
+            if link in resolved:
+                target, visited = resolved.pop(link)
+                if target is not None:
+                    links[target] = [l for l in links[target] if l != link]
+                    if not links[target]:
+                        del links[target]
+                for path in visited:
+                    visitors[path] = visitors[path] - {link}
+                    if not visitors[path]:
+                        del visitors[path]
+            entry = self.entries.get(link)
+            if entry is None or not entry.is_link:
+                continue
+            target, visited = resolved[link] = self.__trace(link)
+            if target is not None:
+                links[target] = list(links.get(target, []))
+                insort(links[target], link)
+            for path in visited:
+                visitors[path] = visitors.get(path, frozenset()) | {link}
+        self._links = links
+        self._resolved = resolved
+        self._visitors = visitors
+
+    def names(self, fpath: str) -> list[str]:
+        """
+        The sorted names of all entities (files and links) matching fpath,
+        except hidden ones (starting with a dot, like globbing them).
+        """
+        if fpath not in self._names:
+            regex = ""
+            for i, part in enumerate(fpath.split("{name}")):
+                if i == 1:
+                    regex += r"(?P<name>(?!\.)[^/]+)"
+                elif i > 1:
+                    regex += "(?P=name)"
+                regex += re.escape(part)
+            pattern = re.compile(regex)
+            self._names[fpath] = sorted(
+                m.group("name")
+                for m in map(pattern.fullmatch, self.entries)
+                if m is not None
+            )
+        return self._names[fpath]
+
+
+class Mirror:
+    """
+    A bare repo shared by all workers (processes) of a pod, see MIRROR.
+    Updating it is serialized between the workers by a file lock and a worker
+    that had to wait for the lock does not fetch again, if another worker
+    started fetching after it asked for the update.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    async def update(self, env: dict[str, str]) -> None:
+        requested = time.time()
+        repo = git.Repo(self.path, env)
+        async with self.__lock():
+            if await self.__get_fetch_start() >= requested:
+                return
+            started = time.time()
+            try:
+                if await Path(f"{self.path}/HEAD").exists():
+                    logger.debug(f"Fetching git mirror at {self.path}")
+                    await repo.fetch()
+                else:
+                    await self.__clone(repo)
+                await Path(f"{self.path}/yac_fetch_start").write_text(str(started))
+            except (git.GitError, OSError) as error:
+                raise RepoError(
+                    f"Cannot update mirror at {self.path}: {error}"
+                ) from error
+
+    async def __clone(self, repo: git.Repo) -> None:
+        logger.info(f"Cloning git mirror to {self.path}")
+        try:
+            await repo.clone(URL, depth=None, branch=BRANCH, bare=True)
+            await repo.set_config(
+                "remote.origin.fetch", f"+refs/heads/{BRANCH}:refs/heads/{BRANCH}"
+            )
+        except git.GitError:
+            # Nobody uses it yet
+            await rmtree(self.path, ignore_errors=True)
+            raise
+
+    async def __get_fetch_start(self) -> float:
+        try:
+            return float(await Path(f"{self.path}/yac_fetch_start").read_text())
+        except (OSError, ValueError):
+            return 0
+
+    @asynccontextmanager
+    async def __lock(self) -> AsyncGenerator[None, None]:
+        try:
+            await Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            file = await open_file(f"{self.path}.lock", "a")
+        except OSError as error:
+            raise RepoError(f"Cannot lock mirror at {self.path}: {error}") from error
+        try:
+            await asyncio.to_thread(fcntl.flock, file.wrapped.fileno(), fcntl.LOCK_EX)
+            yield
+        finally:
+            await file.aclose()  # releases the lock
+
+
+class Write:
+    """
+    What a writer committed: its commit (replaced if it is applied onto the
+    remote branch again, see GitRepo.__publish), files and the paths no file
+    may link to once it is applied (see GitRepo.__committing), the error if it
+    had to be dropped, the outcome of pushing it with a group (see
+    GROUP_WINDOW) and the Diff to update with the pushed commit.
+    """
+
+    def __init__(self) -> None:
+        self.commit: str | None = None
+        self.files: list[str] = []
+        self.unlinked: list[str] = []
+        self.error: RepoError | None = None
+        self.pushed: asyncio.Future | None = None
+        self.diff: Diff | None = None
 
 
 class GitRepo(Repo):
     def __init__(self) -> None:
-        self.fpath: str = ""
         self.dirty: bool = False
         self.writing: bool = False
         self.path: str = f"/repo/{getpid()}"
-        self.repo: git.Repo
-        self._reader_count: int = 0  # writer = -1
+        self._repo: git.Repo | None = None  # of the last request
+        self._reader_count: int = 0  # cloning = -1
         self._reader_update_lock: asyncio.Lock = asyncio.Lock()
         self._no_readers: asyncio.Condition = asyncio.Condition(
             self._reader_update_lock
         )
         self._writer_lock: asyncio.Lock = asyncio.Lock()
+        # Lock and number of writers using it by file (see __lock_entities)
+        self._entity_locks: dict[str, tuple[asyncio.Lock, int]] = {}
+        # Count, total and max time spent waiting for a lock by phase
+        self._lock_stats: dict[str, list] = {}
+        self._fetch_lock: asyncio.Lock = asyncio.Lock()  # for any fetch or pull
+        self._index: Index | None = None  # what has been pushed
+        self._mirror: Mirror | None = Mirror(MIRROR) if MIRROR else None
+        # The writers whose commits are not pushed yet (see GROUP_WINDOW), the
+        # commit they are based on and the index of HEAD only writers see
+        self._group: list[Write] | None = None
+        self._group_base: str = ""
+        self._group_index: Index | None = None
+        self._flushing: asyncio.Task | None = None
+        # When the data was last fetched (see time.monotonic) and the
+        # background fetching (see FETCH_INTERVAL)
+        self._fetched: float | None = None
+        self._fetcher: asyncio.Task | None = None
+        self._fetch_requested: asyncio.Event | None = None
+        self._next_fetch: asyncio.Future | None = None
+        # Looking up the commit of the branch on the remote (see PROBE_TTL)
+        self._probe: asyncio.Task | None = None
+        self._probed: float = 0
+
+    @property
+    def repo(self) -> git.Repo:
+        return REQUEST_REPO.get() or self._repo
+
+    @property
+    def fpath(self) -> str:
+        return REQUEST_FPATH.get()
 
     def __update(self, user: User | None, details: dict, dirty: bool, writing: bool):
         user_name = user.full_name if user is not None else "Unknown"
         user_email = user.email if user is not None else "<>"
         self.dirty = dirty
         self.writing = writing
-        self.repo = git.Repo(
+        self._repo = git.Repo(
             path=self.path,
             env={
                 "EMAIL": user_email,
@@ -90,12 +481,15 @@ class GitRepo(Repo):
                 "LANG": "C",
             },
         )
+        REQUEST_REPO.set(self._repo)
         try:
             self.fpath.format(name="*")
         except (AttributeError, KeyError) as error:
             raise RepoSpecsError(
                 "In type details: file does not contain {name}"
             ) from error
+        if FETCH_INTERVAL > 0:
+            self.__start_fetcher()
 
     @asynccontextmanager
     async def reader(
@@ -104,14 +498,20 @@ class GitRepo(Repo):
         self.__update(user, details, dirty, writing=False)
 
         logger.debug(f"Aquiring git reader lock for {self.repo.path}...")
-        if not self.dirty or await self.__is_outdated():
+        if FETCH_INTERVAL > 0 and self._fetched is not None:
+            await self.__check_staleness()
+        elif (not self.dirty or await self.__is_outdated()) and not (
+            # The next writer (or fetch) pulls, once the push is done
+            await self.__is_pushing()
+            or await self.__is_current()
+        ):
             logger.debug(
                 f"Upgrading lock to git writer lock to pull repo at {self.repo.path}!"
             )
             async with self.writer(user, details=details):
                 pass
 
-        # Downgrade to a reader lock
+        # Downgrade to a reader lock (which only waits for a fresh clone)
         async with self._reader_update_lock:
             while self._reader_count == -1:
                 await self._no_readers.wait()
@@ -119,7 +519,11 @@ class GitRepo(Repo):
             self._reader_count += 1
 
         try:
-            yield self
+            snapshot = SNAPSHOT.set(await self.__get_index())
+            try:
+                yield self
+            finally:
+                SNAPSHOT.reset(snapshot)
         except git.GitTimeoutError as error:
             raise RepoTimeoutError(str(error)) from error
         finally:
@@ -137,25 +541,135 @@ class GitRepo(Repo):
         self.__update(user, details, dirty=False, writing=True)
 
         logger.debug(f"Aquiring git writer lock for {self.repo.path}...")
+        async with self.__exclusive("pull"):
+            # Commits waiting to be pushed are based on the last pull already
+            if self._group is None and not await self.__is_current():
+                await self.__pull()
+
+        # The methods lock the entities and the repo to commit (see __committing)
+        write = Write()
+        snapshot = SNAPSHOT.set(None)  # if used within a reader
+        writing = WRITE.set(write)
+        try:
+            yield self
+        except git.GitTimeoutError as error:
+            raise RepoTimeoutError(str(error)) from error
+        finally:
+            SNAPSHOT.reset(snapshot)
+            WRITE.reset(writing)
+
+        if write.pushed is not None:
+            # Without holding the lock, so others can join the group meanwhile
+            commit = await asyncio.shield(write.pushed)
+            if write.diff is not None:
+                write.diff.hash = commit
+
+    def lock_info(self) -> dict[str, LockInfo]:
+        """
+        Statistics of the time spent waiting for the writer lock to pull, to
+        commit (and push), to fetch or push in the background (flush) and for
+        the locks of the entities by phase.
+        """
+        return {
+            phase: LockInfo(count, total / count, longest)
+            for phase, (count, total, longest) in self._lock_stats.items()
+        }
+
+    def __record_wait(self, phase: str, started: float) -> None:
+        waited = time.monotonic() - started
+        stats = self._lock_stats.setdefault(phase, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += waited
+        stats[2] = max(stats[2], waited)
+
+    @asynccontextmanager
+    async def __exclusive(self, phase: str) -> AsyncGenerator[None, None]:
+        started = time.monotonic()
         async with self._writer_lock:
-            async with self._reader_update_lock:
-                while self._reader_count != 0:
-                    await self._no_readers.wait()
-                logger.debug(f"... git writer lock for {self.repo.path} aquired!")
-                self._reader_count = -1  # Indicate a writer is active
-            await self.__pull()
+            self.__record_wait(phase, started)
+            logger.debug(f"... git writer lock for {self.repo.path} aquired!")
+            yield
 
+    @asynccontextmanager
+    async def __lock_entities(self, *names: str) -> AsyncGenerator[None, None]:
+        """
+        Locks the files of the entities (always in the same order, so writers
+        locking the same ones do not deadlock).
+        """
+        started = time.monotonic()
+        files = sorted({self.fpath.format(name=name) for name in names})
+        locks, acquired = [], []
+        try:
+            for file in files:
+                lock, users = self._entity_locks.get(file, (asyncio.Lock(), 0))
+                self._entity_locks[file] = (lock, users + 1)
+                locks.append((file, lock))
+                await lock.acquire()
+                acquired.append(lock)
+            self.__record_wait("entity", started)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            for file, lock in locks:
+                users = self._entity_locks[file][1] - 1
+                if users == 0:
+                    del self._entity_locks[file]
+                else:
+                    self._entity_locks[file] = (lock, users)
+
+    @asynccontextmanager
+    async def __committing(
+        self,
+        base: str,
+        files: list[str],
+        msg: str,
+        unlinked: list[str] | None = None,
+    ) -> AsyncGenerator[None, None]:
+        """
+        Changes the files (in the body), commits and pushes them while holding
+        the writer lock. The entities were checked at the commit base, so if
+        any of the files (including the sources read) has changed since then
+        (e.g. pulled by another writer) or any of the unlinked paths (of files
+        to delete) is linked now, RepoConflict is raised before the body.
+        """
+        async with self.__exclusive("commit"):
             try:
-                yield self
-            except git.GitTimeoutError as error:
-                raise RepoTimeoutError(str(error)) from error
-            finally:
-                async with self._reader_update_lock:
-                    self._reader_count = 0
-                    self._no_readers.notify_all()
+                head = await self.repo.get_hash()
+                changed = head != base and await self.repo.changed_files(
+                    base, head, files
+                )
+                linked = head != base and await self.__is_linked(unlinked or [])
+            except git.GitError as error:
+                raise RepoError(f"Unable to compare changes: {error}") from error
+            if changed:
+                raise RepoConflict("The data has changed in the meantime")
+            if linked:
+                raise RepoConflict("The file has been linked in the meantime")
+            if (write := WRITE.get()) is not None:
+                write.unlinked = unlinked or []
+            try:
+                yield
+            except Exception:
+                await self.__cleanup("HEAD")  # e.g. only some files were changed
+                raise
+            await self.__push(base, files, msg)
+
+    @asynccontextmanager
+    async def __without_readers(self) -> AsyncGenerator[None, None]:
+        async with self._reader_update_lock:
+            while self._reader_count != 0:
+                await self._no_readers.wait()
+            self._reader_count = -1  # Indicate the repo is cloned
+        try:
+            yield
+        finally:
+            async with self._reader_update_lock:
+                self._reader_count = 0
+                self._no_readers.notify_all()
 
     def update_details(self, details: dict) -> None:
-        self.fpath = details.get("file", "")
+        REQUEST_FPATH.set(details.get("file", ""))
 
     async def __is_outdated(self) -> bool:
         try:
@@ -166,52 +680,382 @@ class GitRepo(Repo):
 
         return (time.time() - last_fetch) > 60 * DIRTY_MAX
 
+    def __start_fetcher(self) -> None:
+        loop = asyncio.get_running_loop()
+        if (
+            self._fetcher is not None
+            and self._fetcher.get_loop() is loop
+            and not self._fetcher.done()
+        ):
+            return
+        if (
+            self._next_fetch is not None
+            and self._next_fetch.get_loop() is loop
+            and not self._next_fetch.done()
+        ):
+            # The strict reads waiting for the fetcher that stopped
+            self._next_fetch.set_result(RepoError("Fetching was restarted"))
+        self._fetch_requested = asyncio.Event()
+        self._next_fetch = loop.create_future()
+        self._fetcher = loop.create_task(self.__fetch_regularly())
+
+    async def __fetch_regularly(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._fetch_requested.clear()
+            fetch, self._next_fetch = self._next_fetch, loop.create_future()
+            try:
+                await self.__refresh()
+                fetch.set_result(None)
+            except RepoError as error:
+                logger.error(f"Fetching in the background failed: {error}")
+                fetch.set_result(error)  # only raised for strict reads
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                # Keep fetching (and never let strict reads wait forever)
+                logger.error(f"Fetching in the background failed: {error}")
+                fetch.set_result(RepoError(f"Fetching failed: {error}"))
+            try:
+                await asyncio.wait_for(self._fetch_requested.wait(), FETCH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def __refresh(self) -> None:
+        """
+        Fetches without any lock (so reads can continue meanwhile) and only
+        locks the repo to fast-forward it.
+        """
+        if self._fetched is None:
+            return  # not pulled (or cloned) yet, see reader
+        if await self.__is_current(fresh=True):
+            return
+        started = time.monotonic()
+        try:
+            await self.__fetch()
+        except (git.GitError, OSError) as error:
+            raise RepoError(f"Cannot fetch into {self.path}: {error}") from error
+        async with self.__exclusive("fetch"):
+            if self._group is not None:
+                return  # it will be pulled by the next writer (see writer)
+            try:
+                await self.repo.merge(f"origin/{BRANCH}", ff_only=True)
+            except git.GitError as error:
+                logger.info(f"Pulling git repo at {self.path} again: {error}")
+                await self.__pull()
+                return
+            await self.__update_index()
+            self._fetched = started
+
+    async def __check_staleness(self) -> None:
+        """
+        Starts fetching right away if the last fetch is older than MAX_STALENESS
+        and waits for it in strict mode.
+        """
+        if time.monotonic() - self._fetched <= MAX_STALENESS:
+            return
+        fetch = self._next_fetch  # the first one starting after now
+        self._fetch_requested.set()
+        if STRICT:
+            error = await asyncio.shield(fetch)
+            if error is not None:
+                raise error
+
+    async def __is_pushing(self) -> bool:
+        """
+        If HEAD is ahead of the index readers use only by commits not pushed
+        yet (see __get_index), so pulling would wait for the push.
+        """
+        if self._group is not None:
+            return True
+        if self._index is None:
+            return False
+        try:
+            return await self.repo.get_hash() != self._index.commit
+        except git.GitError:
+            return False
+
+    async def __is_current(self, *, fresh: bool = False) -> bool:
+        """
+        If HEAD is the commit of the branch on the remote (at most PROBE_TTL
+        seconds ago or now if fresh is set), so pulling would not change
+        anything.
+        """
+        if PROBE_TTL <= 0 or self._index is None or self._group is not None:
+            return False
+        try:
+            remote = await self.__probe(time.monotonic() - (0 if fresh else PROBE_TTL))
+            local = await self.repo.get_hash()
+        except (git.GitError, OSError) as error:
+            logger.debug(f"Cannot compare HEAD of {self.path} to remote: {error}")
+            return False
+        if remote is None or remote != local:
+            return False
+        logger.debug(f"Git repo at {self.path} is up to date, not pulling")
+        self._fetched = self._probed
+        return True
+
+    async def __probe(self, not_before: float) -> str | None:
+        """
+        Reuses the last git ls-remote (even if it is still running) if it was
+        started at not_before (see time.monotonic) or later.
+        """
+        loop = asyncio.get_running_loop()
+        if (
+            self._probe is None
+            or self._probe.get_loop() is not loop
+            or self._probed < not_before
+        ):
+            self._probed = time.monotonic()
+            self._probe = loop.create_task(
+                self.repo.ls_remote(URL, f"refs/heads/{BRANCH}")
+            )
+        return await asyncio.shield(self._probe)
+
     async def __pull(self) -> None:
+        started = time.monotonic()
+        async with self._fetch_lock:
+            await self.__pull_or_clone()
+        await self.__update_index()
+        self._fetched = started
+
+    async def __pull_or_clone(self) -> None:
+        if self._mirror is not None:
+            await self._mirror.update(self.repo.env)
         try:
             if not self.repo.loaded:
                 await self.repo.load()
             logger.debug(f"Pulling git repo at {self.path}")
             await self.repo.pull()
         except git.GitError:
-            try:
-                await rmtree(self.path)
-            except FileNotFoundError:
-                pass  # it may not be there yet
-            except OSError as error:
-                raise RepoError(f"Cannot delete {self.path}") from error
-            logger.info(f"Cloning git repo to {self.path}")
-            try:
-                await self.repo.clone(URL, branch=BRANCH)
-            except git.GitError as error:
-                raise RepoError(f"Cannot clone repo to {self.path}: {error}") from error
+            # The objects of the snapshots of the readers are deleted as well
+            async with self.__without_readers():
+                await self.__clone()
 
-    async def __push(self, files: list[str], msg: str):
+    async def __clone(self) -> None:
+        try:
+            await rmtree(self.path)
+        except FileNotFoundError:
+            pass  # it may not be there yet
+        except OSError as error:
+            raise RepoError(f"Cannot delete {self.path}") from error
+        logger.info(f"Cloning git repo to {self.path}")
+        try:
+            if self._mirror is None:
+                await self.repo.clone(URL, branch=BRANCH)
+            else:
+                await self.repo.clone(
+                    self._mirror.path, depth=None, branch=BRANCH, shared=True
+                )
+                await self.repo.set_config("remote.origin.pushurl", URL)
+        except git.GitError as error:
+            raise RepoError(f"Cannot clone repo to {self.path}: {error}") from error
+
+    async def __update_index(self, *, pushed: bool = True) -> None:
+        """
+        Updates the index to the current HEAD (incrementally if possible). If
+        HEAD is not pushed yet, only writers see it (see __get_index).
+        """
+        index = self._index if pushed else self._group_index or self._index
+        try:
+            commit = await self.repo.get_hash()
+            if index is not None and index.commit != commit:
+                try:
+                    index = await index.update(self.repo, commit)
+                except git.GitError as error:
+                    logger.info(f"Rebuilding index of {self.path}: {error}")
+                    index = None
+            if index is None:
+                logger.debug(f"Indexing git repo at {self.path}")
+                index = await Index.build(self.repo, commit)
+        except git.GitError as error:
+            self._index = self._group_index = None
+            raise RepoError(f"Cannot index repo at {self.path}: {error}") from error
+        if pushed:
+            self._index, self._group_index = index, None
+        else:
+            self._group_index = index
+
+    async def __get_index(self) -> Index:
+        """
+        The snapshot of a reader, otherwise the pushed index or for writers the
+        one with the commits not pushed yet.
+        """
+        snapshot = SNAPSHOT.get()
+        if snapshot is not None:
+            return snapshot
+        if WRITE.get() is not None and self._group is not None:
+            if self._group_index is not None:
+                return self._group_index
+        if self._index is None:
+            await self.__update_index()
+        return self._index
+
+    async def __push(self, base: str, files: list[str], msg: str):
+        """
+        Commits and pushes the files, which were checked at base.
+        """
+        if GROUP_WINDOW > 0:
+            await self.__commit(files, msg)
+            return
+        write = WRITE.get() or Write()
+        write.files = files
         try:
             await self.repo.add(files)
             await self.repo.commit(f"[YAC] {msg}")
-            logger.debug(f"Pushing new git commit from {self.path} to remote")
-            await self.repo.push()
+            write.commit = await self.repo.get_hash()
+            await self.__publish(base, [write])
+            if write.error is not None:
+                raise write.error
+        except RepoError:
+            await self.__cleanup(force=True)
+            await self.__update_index()
+            raise
         except git.GitError as error:
-            # Very unlikely scenario where someone pushes from a different
-            # instance or directly to the repo in the millisecond between
-            # pull and push. If this occurs more often then expected (~ never)
-            # we can implement a retry mechanism here.
-            await self.__cleanup()
+            await self.__cleanup(force=True)
+            await self.__update_index()
             raise RepoError(
                 f"Unable to commit and push changes from {self.path}"
             ) from error
         await self.__cleanup()
-
-    async def __cleanup(self):
-        if not await self.repo.is_dirty():
+        await self.__update_index()
+
+    async def __fetch(self) -> None:
+        async with self._fetch_lock:
+            if self._mirror is not None:
+                await self._mirror.update(self.repo.env)
+            await self.repo.fetch()
+
+    async def __publish(self, base: str, writes: list[Write]) -> None:
+        """
+        Pushes the commits of the writes (made on top of base in this order).
+        If the push is rejected, because someone else pushed in the meantime
+        (e.g. another instance), they are applied onto the remote branch one by
+        one and pushed again (see PUSH_RETRIES). A commit is dropped (and the
+        RepoConflict set as error of its write) if any of its files has been
+        changed remotely since base, as all checks were done on base, or if it
+        can not be applied.
+        """
+        for attempt in range(PUSH_RETRIES + 1):
+            try:
+                logger.debug(f"Pushing new git commits from {self.path} to remote")
+                await self.repo.push()
+                return
+            except git.GitTimeoutError:
+                raise
+            except git.GitError as error:
+                if attempt == PUSH_RETRIES or "[rejected]" not in str(error):
+                    raise
+            logger.info(f"Push from {self.path} rejected, reapplying (#{attempt + 1})")
+            await asyncio.sleep(PUSH_BACKOFF * 2**attempt * random.uniform(0.5, 1.5))
+            await self.__fetch()
+            await self.__reapply(base, writes)
+
+    async def __reapply(self, base: str, writes: list[Write]) -> None:
+        upstream = f"origin/{BRANCH}"
+        await self.repo.reset(upstream, hard=True)
+        for write in writes:
+            if write.error is not None:
+                continue  # dropped already
+            if await self.repo.changed_files(base, upstream, write.files):
+                write.error = RepoConflict("The data has changed in the meantime")
+                continue
+            try:
+                await self.repo.cherry_pick(write.commit)
+            except git.GitError as error:
+                logger.info(f"Cannot apply {write.commit} onto {upstream}: {error}")
+                write.error = RepoConflict("The data has changed in the meantime")
+                continue
+            if await self.__is_linked(write.unlinked):
+                await self.repo.reset("HEAD~1", hard=True)
+                write.error = RepoConflict("The file has been linked in the meantime")
+                continue
+            write.commit = await self.repo.get_hash()
+
+    async def __is_linked(self, paths: list[str]) -> bool:
+        """
+        If any file links to one of the paths at HEAD.
+        """
+        if not paths:
+            return False
+        index = await self.__get_index()
+        head = await self.repo.get_hash()
+        if index.commit != head:
+            index = await index.update(self.repo, head)
+        return any(index.linked_by(path) for path in paths)
+
+    async def __commit(self, files: list[str], msg: str):
+        """
+        Commits without pushing and joins the group of commits pushed together
+        at the end of the current window (see GROUP_WINDOW and __flush).
+        """
+        write = WRITE.get() or Write()
+        write.files = files
+        try:
+            base = await self.repo.get_hash()
+            await self.repo.add(files)
+            await self.repo.commit(f"[YAC] {msg}")
+            write.commit = await self.repo.get_hash()
+        except git.GitError as error:
+            # Keep the commits of the others in the group
+            await self.__cleanup("HEAD")
+            await self.__update_index(pushed=self._group is None)
+            raise RepoError(f"Unable to commit changes in {self.path}") from error
+        if self._group is None:
+            self._group = []
+            self._group_base = base
+            self._flushing = asyncio.create_task(self.__flush(self._group))
+        write.pushed = asyncio.get_running_loop().create_future()
+        self._group.append(write)
+        await self.__update_index(pushed=False)
+
+    async def __flush(self, group: list[Write]):
+        await asyncio.sleep(GROUP_WINDOW)
+        async with self.__exclusive("flush"):
+            if group is not self._group:
+                return  # the commits are gone already (see __cleanup)
+            self._group = None
+            failure = None
+            try:
+                await self.__publish(self._group_base, group)
+            except RepoError as error:
+                failure = error
+            except git.GitTimeoutError as error:
+                failure = RepoTimeoutError(str(error))
+            except git.GitError as error:
+                failure = RepoError(f"Unable to push changes from {self.path}: {error}")
+            try:
+                if failure is not None:
+                    await self.__cleanup(force=True)
+                await self.__update_index()
+            except RepoError as error:
+                logger.error(str(error))
+            # Only now, so the writers see the repo as pushed (or reset)
+            for write in group:
+                if write.error is not None:
+                    write.pushed.set_exception(write.error)
+                elif failure is not None:
+                    write.pushed.set_exception(failure)
+                else:
+                    write.pushed.set_result(write.commit)
+
+    async def __cleanup(self, rev: str = f"origin/{BRANCH}", *, force: bool = False):
+        """
+        Resets the repo to rev if it is dirty (or always if force is set).
+        """
+        if not force and not await self.repo.is_dirty():
             return
         try:
             logger.debug(f"Cleaning git repo at {self.path}")
-            await self.repo.reset(f"origin/{BRANCH}", hard=True)
+            await self.repo.reset(rev, hard=True)
             await self.repo.clean(recursive=True, force=True)
             assert not await self.repo.is_dirty()
         except (git.GitError, AssertionError):
-            # Try a complete fresh clone before giving up
+            # Try a complete fresh clone before giving up, which drops the
+            # commits not pushed yet
+            group, self._group = self._group, None
+            for write in group or []:
+                write.pushed.set_exception(
+                    RepoError(f"Unable to clean up git repo at {self.path}")
+                )
             await self.__pull()
 
     def __make_relative(self, path: str, path2: str) -> str:
@@ -228,84 +1072,78 @@ class GitRepo(Repo):
         backpath = f"../" * relative.count("/")
         return f"{backpath}{relative}"
 
-    async def __has_link(self, name: str) -> bool:
-        file_name = "/".join([self.path, self.fpath.format(name=name)])
-        async for root, _, files in Path(dirname(file_name)).walk():
-            for file in files:
-                file_path = Path(f"{root}/{file}")
-                if await file_path.is_link():
-                    link_target = await file_path.resolve()
-                    if link_target != file_path:
-                        if (
-                            await Path(link_target).resolve()
-                            == await Path(file_name).resolve()
-                        ):
-                            return True
-        return False
-
-    async def __read(self, file: str, *, absolute: bool = True) -> str:
-        absfile = file if absolute else f"{self.path}/{file}"
+    async def __read(self, file: str, index: Index | None = None) -> str:
+        """
+        Reads the file (relative to the repo) at HEAD (or the commit of index)
+        from git (see git.Batch).
+        """
+        if index is None:
+            index = await self.__get_index()
+        resolved = index.resolve(posixpath.normpath(file))
+        if resolved is None or resolved not in index.entries:
+            raise RepoNotFound(f"The file {file} does not exist")
         try:
-            async with await open_file(absfile, "r", encoding="utf-8") as f:
-                logger.debug(f"Reading file {absfile}")
-                return await f.read()
-        except FileNotFoundError as error:
-            raise RepoNotFound(f"The file {file} does not exist") from error
-        except OSError as error:
-            raise RepoError(f"Could not read file {absfile}") from error
+            logger.debug(f"Reading file {file}")
+            content = await self.repo.read_blob(index.entries[resolved].obj)
+            # Same as reading a file in text mode (universal newlines)
+            return content.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+        except git.GitTimeoutError:
+            raise
+        except (git.GitError, UnicodeDecodeError) as error:
+            raise RepoError(f"Could not read file {file}: {error}") from error
 
     async def get_hash(self) -> str:
+        snapshot = SNAPSHOT.get()
+        if snapshot is not None:
+            return snapshot.commit
         return await self.repo.get_hash()
 
+    async def __diff(self, name: str, patch: str) -> Diff:
+        write = WRITE.get()
+        if write is None or write.commit is None:
+            return Diff(name=name, hash=await self.get_hash(), patch=patch)
+        # Not HEAD, as others may have committed since (see __committing)
+        diff = Diff(name=name, hash=write.commit, patch=patch)
+        if write.pushed is not None:
+            write.diff = diff  # its commit may still be reapplied (see writer)
+        return diff
+
+    async def get_linked_by(self, name: str) -> list[str]:
+        names = []
+        for link in (await self.__get_index()).linked_by(self.fpath.format(name=name)):
+            result = parse(self.fpath, link)
+            if result is not None and "name" in result.named:
+                names.append(result.named["name"])
+        return names
+
     async def list(self) -> list[str]:
-        glob = self.fpath.format(name="*")
-        try:
-            return sorted(
-                [
-                    parse(f"{self.path}/{self.fpath}", str(fn)).named["name"]
-                    async for fn in Path(self.path).glob(glob)
-                ]
-            )
-        except OSError as error:
-            raise RepoError(f"Could not list files at {self.path}/{glob}") from error
+        return list((await self.__get_index()).names(self.fpath))
 
     async def exists(self, name: str) -> bool:
-        file = "/".join([self.path, self.fpath.format(name=name)])
-        try:
-            return await Path(file).exists()
-        except OSError as error:
-            raise RepoError(f"Could not read file {file}") from error
+        return (await self.__get_index()).exists(self.fpath.format(name=name))
 
     async def is_link(self, name: str) -> bool:
-        file = "/".join([self.path, self.fpath.format(name=name)])
-        try:
-            return await Path(file).is_symlink()
-        except OSError as error:
-            raise RepoError(f"Could not read file {file}") from error
+        return (await self.__get_index()).is_link(self.fpath.format(name=name))
 
     async def get_link(self, name: str) -> str:
         if not await self.is_link(name):
             raise RepoError(f"File {name} is not a link")
 
-        base = str(await Path(self.path).resolve())
-        src = "/".join([base, self.fpath.format(name=name)])
-        dest = str(await Path(src).resolve())
+        src = self.fpath.format(name=name)
+        link = (await self.__get_index()).resolve(src)
+        if link is None:
+            raise RepoError(f"Link {src} has an illegal destination")
 
-        if not dest.startswith(base):
-            raise RepoError(f"Link {src} has an illegal destination: {dest}")
-
-        link = dest[(len(base) + 1) :]
         try:
             return parse(self.fpath, link).named["name"]
         except (AttributeError, KeyError) as error:
-            raise RepoError(f"Link {src} has an illegal destination: {dest}") from error
+            raise RepoError(f"Link {src} has an illegal destination: {link}") from error
 
     async def get_specs(self, name: str) -> str:
-        return await self.__read(name, absolute=False)
+        return await self.__read(name)
 
     async def get(self, name: str) -> str:
-        file = "/".join([self.path, self.fpath.format(name=name)])
-        return await self.__read(file, absolute=True)
+        return await self.__read(self.fpath.format(name=name))
 
     async def write(
         self, name: str, content_old: str, content_new: str, msg: str
@@ -313,25 +1151,28 @@ class GitRepo(Repo):
         path = self.fpath.format(name=name)
         file = f"{self.path}/{path}"
 
-        if await self.exists(name):
-            content = await self.get(name)
-            if content != content_old:
-                raise RepoConflict("The data has changed in the meantime")
-            if content == content_new:
-                raise RepoClientError("Cannot write without changing anything")
-            if await self.is_link(name):
-                raise RepoClientError("Modifying links is not allowed")
-        elif len(content_old) > 0:
-            raise RepoConflict("The file has been deleted in the meantime")
+        async with self.__lock_entities(name):
+            # Everything is checked at the same commit (the fetcher may pull)
+            index = await self.__get_index()
+            if index.exists(path):
+                content = await self.__read(path, index)
+                if content != content_old:
+                    raise RepoConflict("The data has changed in the meantime")
+                if content == content_new:
+                    raise RepoClientError("Cannot write without changing anything")
+                if index.is_link(path):
+                    raise RepoClientError("Modifying links is not allowed")
+            elif len(content_old) > 0:
+                raise RepoConflict("The file has been deleted in the meantime")
+
+            async with self.__committing(index.commit, [file], msg):
+                try:
+                    async with await open_file(file, "w+", encoding="utf-8") as f:
+                        logger.debug(f"Writing file {file}")
+                        await f.write(content_new)
+                except OSError as error:
+                    raise RepoError(f"Could not write file {file}") from error
 
-        try:
-            async with await open_file(file, "w+", encoding="utf-8") as f:
-                logger.debug(f"Writing file {file}")
-                await f.write(content_new)
-        except OSError as error:
-            raise RepoError(f"Could not write file {file}") from error
-
-        await self.__push([file], msg)
         patch = "\n".join(
             unified_diff(
                 content_old.split("\n"),
@@ -342,7 +1183,7 @@ class GitRepo(Repo):
             )
         )
 
-        return Diff(name=name, hash=await self.get_hash(), patch=patch)
+        return await self.__diff(name, patch)
 
     async def write_rename(
         self, name_old: str, name_new: str, content_old: str, content_new: str, msg: str
@@ -354,30 +1195,32 @@ class GitRepo(Repo):
 
         if name_old == name_new:
             raise RepoClientError("Cannot rename without chaning the name")
-        if await self.exists(name_old):
-            content = await self.get(name_old)
-            if content != content_old:
-                raise RepoConflict("The data has changed in the meantime")
-            if await self.is_link(name_old):
-                raise RepoClientError("Modifying links is not allowed")
-        else:
-            raise RepoConflict("The file has been deleted in the meantime")
-        if await self.exists(name_new):
-            raise RepoClientError("The file already exists")
-
-        try:
-            async with await open_file(file_new, "w+", encoding="utf-8") as f:
-                logger.debug(f"Writing file {file_new}")
-                await f.write(content_new)
-        except OSError as error:
-            raise RepoError(f"Could not write file {file_new}") from error
-
-        try:
-            await Path(file_old).remove()
-        except OSError as error:
-            raise RepoError(f"Could not delete file {file_old}") from error
+        async with self.__lock_entities(name_old, name_new):
+            index = await self.__get_index()
+            if index.exists(path_old):
+                content = await self.__read(path_old, index)
+                if content != content_old:
+                    raise RepoConflict("The data has changed in the meantime")
+                if index.is_link(path_old):
+                    raise RepoClientError("Modifying links is not allowed")
+            else:
+                raise RepoConflict("The file has been deleted in the meantime")
+            if index.exists(path_new):
+                raise RepoClientError("The file already exists")
+
+            async with self.__committing(index.commit, [file_old, file_new], msg):
+                try:
+                    async with await open_file(file_new, "w+", encoding="utf-8") as f:
+                        logger.debug(f"Writing file {file_new}")
+                        await f.write(content_new)
+                except OSError as error:
+                    raise RepoError(f"Could not write file {file_new}") from error
+
+                try:
+                    await Path(file_old).unlink()
+                except OSError as error:
+                    raise RepoError(f"Could not delete file {file_old}") from error
 
-        await self.__push([file_old, file_new], msg)
         patch = "\n".join(
             unified_diff(
                 content_old.split("\n"),
@@ -388,26 +1231,29 @@ class GitRepo(Repo):
             )
         )
 
-        return Diff(name=name_new, hash=await self.get_hash(), patch=patch)
+        return await self.__diff(name_new, patch)
 
     async def copy(self, name_dest: str, name_src: str, msg: str) -> Diff:
-        if await self.exists(name_dest):
-            raise RepoClientError("The file already exists")
-
         path_dest = self.fpath.format(name=name_dest)
-        file_src = "/".join([self.path, self.fpath.format(name=name_src)])
         file_dest = f"{self.path}/{path_dest}"
+        file_src = "/".join([self.path, self.fpath.format(name=name_src)])
 
-        content = await self.__read(file_src, absolute=True)
+        async with self.__lock_entities(name_dest, name_src):
+            index = await self.__get_index()
+            if index.exists(path_dest):
+                raise RepoClientError("The file already exists")
 
-        try:
-            async with await open_file(file_dest, "w+", encoding="utf-8") as f:
-                logger.debug(f"Writing file {file_dest}")
-                await f.write(content)
-        except OSError as error:
-            raise RepoError(f"Could not create file {file_dest}") from error
+            content = await self.__read(self.fpath.format(name=name_src), index)
+
+            # The source is checked for changes as well (and added unchanged)
+            async with self.__committing(index.commit, [file_dest, file_src], msg):
+                try:
+                    async with await open_file(file_dest, "w+", encoding="utf-8") as f:
+                        logger.debug(f"Writing file {file_dest}")
+                        await f.write(content)
+                except OSError as error:
+                    raise RepoError(f"Could not create file {file_dest}") from error
 
-        await self.__push([file_dest], msg)
         patch = "\n".join(
             unified_diff(
                 [],
@@ -418,24 +1264,26 @@ class GitRepo(Repo):
             )
         )
 
-        return Diff(name=name_dest, hash=await self.get_hash(), patch=patch)
+        return await self.__diff(name_dest, patch)
 
     async def link(self, name_link: str, name_src: str, msg: str) -> Diff:
-        if not await self.exists(name_src):
-            raise RepoNotFound("The file does not exist")
-
         path_link = self.fpath.format(name=name_link)
         link = f"{self.path}/{path_link}"
         src = "/".join([self.path, self.fpath.format(name=name_src)])
 
-        try:
-            await Path(link).symlink_to(self.__make_relative(src, link))
-        except FileExistsError as error:
-            raise RepoClientError("The file already exists") from error
-        except OSError as error:
-            raise RepoError(f"Could not create symlink {link}") from error
+        async with self.__lock_entities(name_link, name_src):
+            index = await self.__get_index()
+            if not index.exists(self.fpath.format(name=name_src)):
+                raise RepoNotFound("The file does not exist")
+
+            async with self.__committing(index.commit, [link, src], msg):
+                try:
+                    await Path(link).symlink_to(self.__make_relative(src, link))
+                except FileExistsError as error:
+                    raise RepoClientError("The file already exists") from error
+                except OSError as error:
+                    raise RepoError(f"Could not create symlink {link}") from error
 
-        await self.__push([link], msg)
         patch = "\n".join(
             unified_diff(
                 [],
@@ -446,21 +1294,26 @@ class GitRepo(Repo):
             )
         )
 
-        return Diff(name=name_link, hash=await self.get_hash(), patch=patch)
+        return await self.__diff(name_link, patch)
 
     async def delete(self, name: str, msg: str) -> None:
-        if not await self.exists(name):
-            raise RepoNotFound("The file does not exist")
-        if await self.__has_link(name):
-            raise RepoClientError("The file must not be deleted because it is linked")
-
-        file = "/".join([self.path, self.fpath.format(name=name)])
-        try:
-            await Path(file).remove()
-        except OSError as error:
-            raise RepoError(f"Could not delete file {file}") from error
+        path = self.fpath.format(name=name)
+        file = f"{self.path}/{path}"
 
-        await self.__push([file], msg)
+        async with self.__lock_entities(name):
+            index = await self.__get_index()
+            if not index.exists(path):
+                raise RepoNotFound("The file does not exist")
+            if index.linked_by(path):
+                raise RepoClientError(
+                    "The file must not be deleted because it is linked"
+                )
+
+            async with self.__committing(index.commit, [file], msg, [path]):
+                try:
+                    await Path(file).unlink()
+                except OSError as error:
+                    raise RepoError(f"Could not delete file {file}") from error
 
 
 handler = GitRepo()
@@ -30,6 +30,9 @@ class GitRedisRepo(Repo):
     async def get_hash(self) -> str:
         return ""  # TODO
 
+    async def get_linked_by(self, name: str) -> list[str]:
+        return []  # TODO
+
     async def list(self) -> list[str]:
         return []  # TODO
 
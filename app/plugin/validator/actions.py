@@ -1,3 +1,4 @@
+from app.lib.perms import has_any
 from app.model.err import RequestForbidden
 from app.model.err import RequestNotFound
 from app.model.inp import OperationRequest
@@ -35,7 +36,7 @@ def test(op: OperationRequest, spec: Specs, old: Entity, new: Entity) -> None:
             raise RequestNotFound(f"Action {action} is not defined for this operation")
 
         perms_required = getattr(action_spec, "perms", ["act"])
-        if len(set(old.perms or []).intersection(set(perms_required))) <= 0:
+        if not has_any(old.perms, perms_required):
             if op.operation == "arbitrary" or not action_spec.force:
                 raise RequestForbidden(
                     f"You need one of these permission to run this action(s): "
@@ -1,4 +1,5 @@
 from app.lib import yaml
+from app.lib.perms import has_all
 from app.model.err import RequestError
 from app.model.err import RequestForbidden
 from app.model.err import ServerError
@@ -14,7 +15,7 @@ from app.model.spc import Specs
 
 
 def __assert_perm(perm: str, perms: list[str] | None):
-    if perm not in (perms or []):
+    if not has_all(perms, (perm,)):
         raise RequestForbidden(
             f'You need the "{perm}" permission to execute this operation.'
         )
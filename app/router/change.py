@@ -60,7 +60,7 @@ async def update_entity(  # pylint: disable=too-many-arguments,dangerous-default
 
         old, new = await repo.get_entities(rpo, op, s)
 
-    validator.test_all(op, s, old, new)
+    await validator.test_all(op, s, old, new)
 
     await action.run(TypeActionHook.CHANGE_BEFORE, op, s)
 
@@ -116,7 +116,7 @@ async def change_entity(  # pylint: disable=too-many-arguments,dangerous-default
 
         old, new = await repo.get_entities(rpo, op, s)
 
-    validator.test_all(op, s, old, new)
+    await validator.test_all(op, s, old, new)
 
     await action.run(TypeActionHook.CHANGE_BEFORE, op, s)
 
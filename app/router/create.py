@@ -59,7 +59,7 @@ async def add_entity(  # pylint: disable=too-many-arguments,dangerous-default-va
 
         old, new = await repo.get_entities(rpo, op, s)
 
-    result = validator.test_all(op, s, old, new)
+    result = await validator.test_all(op, s, old, new)
 
     await action.run(TypeActionHook.CREATE_BEFORE, op, s)
 
@@ -56,7 +56,7 @@ async def delete_entity(  # pylint: disable=too-many-arguments,dangerous-default
 
         old, new = await repo.get_entities(rpo, op, s)
 
-    validator.test_all(op, s, old, new)
+    await validator.test_all(op, s, old, new)
 
     await action.run(TypeActionHook.DELETE_BEFORE, op, s)
 
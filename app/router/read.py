@@ -5,6 +5,7 @@ from fastapi import Request
 from fastapi.responses import PlainTextResponse
 
 from app.lib import log
+from app.lib import perms
 from app.lib import repo
 from app.lib import specs
 from app.lib import validator
@@ -50,9 +51,9 @@ async def get_types(
 
     if specs.in_repo():
         async with repo.handler.reader(op.user, details={}, dirty=True) as rpo:
-            s = await specs.read_from_repo(rpo, op)
+            s = await specs.read_from_repo(rpo, op, all_types=True)
     else:
-        s = await specs.read_from_file(op)
+        s = await specs.read_from_file(op, all_types=True)
 
     # List comprehension dict hack is required because otherwise pydantic 2.7.4
     # returns the whole object instead of reducing it to the values of out.Type.
@@ -99,17 +100,18 @@ async def get_entities(  # pylint: disable=too-many-arguments
         validator.test_ls(op, s)
 
         list_hash = await rpo.get_hash()
+        memo = {}  # see perms.get_from_roles
         for entity_name in await rpo.list():
             if not search in entity_name:
                 continue  # skip the entities where search is not a substring
 
             op.name = entity_name
             try:
-                old, _ = await repo.get_entities(rpo, op, s)
+                old, _ = await repo.get_entities(rpo, op, s, memo=memo)
             except RepoError as error:
                 logger.warning(error)
                 continue  # skip the entities we have errors reading
-            if "see" not in (old.perms or []):
+            if not perms.has_all(old.perms, ("see",)):
                 continue  # skip the entities we have no permissions
 
             result.append(repo.to_detailed_entity(old, list_hash, s.type))
@@ -155,7 +157,7 @@ async def get_entity(
         old, new = await repo.get_entities(rpo, op, s)
         entity_hash = await rpo.get_hash()
 
-    validator.test_all(op, s, old, new)
+    await validator.test_all(op, s, old, new)
 
     return repo.to_detailed_entity(old, entity_hash, s.type)
 
@@ -192,7 +194,7 @@ async def get_entity_yaml(
 
         old, new = await repo.get_entities(rpo, op, s)
 
-    validator.test_all(op, s, old, new)
+    await validator.test_all(op, s, old, new)
 
     return PlainTextResponse(content=old.yaml, media_type="application/yaml")
 
@@ -230,6 +232,6 @@ async def get_entity_logs(
 
         old, new = await repo.get_entities(rpo, op, s)
 
-    validator.test_all(op, s, old, new)
+    await validator.test_all(op, s, old, new)
 
     return await log.get(op, s)
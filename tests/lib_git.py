@@ -0,0 +1,68 @@
+import asyncio
+import subprocess
+import tempfile
+
+from app.lib import git
+
+
+def commit(path, file, content):
+    with open(f'{path}/{file}', 'w', encoding='utf-8') as f:
+        f.write(content)
+    subprocess.run(['git', 'add', file], cwd=path, check=True)
+    subprocess.run(
+        ['git', '-c', 'user.name=test', '-c', 'user.email=test@localhost', 'commit', '-qm', file],
+        cwd=path,
+        check=True,
+    )
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=path).decode().strip()
+
+
+async def check(path):
+    repo = git.Repo(path)
+    head = commit(path, 'a.yml', 'a: 1\n')
+    assert await repo.get_hash() == head
+
+    entries = {p: obj for _, _, obj, p in await repo.ls_tree()}
+    assert await repo.read_blob(entries['a.yml']) == b'a: 1\n'
+    blobs = await asyncio.gather(*(repo.read_blob(entries['a.yml']) for _ in range(50)))
+    assert all(b == b'a: 1\n' for b in blobs)
+
+    head = commit(path, 'b.yml', 'b: 1\n')
+    assert await repo.get_hash() == head
+
+    subprocess.run(['git', 'pack-refs', '--all'], cwd=path, check=True)
+    assert await repo.get_hash() == head
+    subprocess.run(['git', 'checkout', '-q', '--detach', 'HEAD~1'], cwd=path, check=True)
+    assert await repo.get_hash() != head
+    subprocess.run(['git', 'checkout', '-q', '-'], cwd=path, check=True)
+    assert await repo.get_hash() == head
+    subprocess.run(['git', 'worktree', 'add', '-q', f'{path}/wt', 'HEAD~1'], cwd=path, check=True)
+    assert await git.Repo(f'{path}/wt').get_hash() != head
+    subprocess.run(['git', 'worktree', 'remove', f'{path}/wt'], cwd=path, check=True)
+
+    try:
+        await repo.read_blob('0' * 40)
+        assert False
+    except git.GitError:
+        pass
+
+    git.Batch.get(path, {})._proc.kill()  # pylint: disable=protected-access
+    await asyncio.sleep(0.1)
+    assert await repo.read_blob(entries['a.yml']) == b'a: 1\n'
+    info = git.Batch.info()[f'{path}:batch']
+    assert info.calls == 53 and info.restarts == 1
+
+    # Concurrent queries while the process starts use the same process
+    await git.Batch.reset(path)
+    entries = {p: obj for _, _, obj, p in await repo.ls_tree()}
+    for _ in range(10):
+        await git.Batch.reset(path)
+        blobs = await repo.cat_blobs([entries['a.yml'], entries['b.yml']])
+        assert blobs == {entries['a.yml']: b'a: 1\n', entries['b.yml']: b'b: 1\n'}
+    await git.Batch.reset(path)
+
+
+def test():
+    with tempfile.TemporaryDirectory() as path:
+        subprocess.run(['git', 'init', '-q'], cwd=path, check=True)
+        asyncio.run(check(path))
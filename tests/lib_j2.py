@@ -0,0 +1,130 @@
+import asyncio
+import time
+
+from app.lib import j2
+from app.lib import plugin
+
+PROPS = {
+    'env': {'domain': 'example.com'},
+    'user': {'name': 'user1'},
+    'old': {'name': 'host1', 'perms': ['see', 'edt']},
+}
+
+SPEC = {
+    'title': 'Hosts of {{ user.name }}',
+    'fqdn': '{{ old.name ~ "." ~ env.domain }}',
+    'static': 'just a string',
+    'number': 5,
+    'enum': '{{ ["a", "b"] }}',
+    'list': ['{{ env.domain }}', True, {'edit': "{{ 'edt' in old.perms }}"}],
+}
+
+RENDERED = {
+    'title': 'Hosts of user1',
+    'fqdn': 'host1.example.com',
+    'static': 'just a string',
+    'number': 5,
+    'enum': ['a', 'b'],
+    'list': ['example.com', True, {'edit': True}],
+}
+
+
+
+@plugin.blocking
+def slow_fqdn(name):
+    time.sleep(0.3)
+    return f'{name}.example.com'
+
+
+@plugin.blocking
+def starts_with_a(value):
+    time.sleep(0.01)
+    return value.startswith('a')
+
+
+PLUGINS = {
+    'j2_functions': {'slow_fqdn': slow_fqdn},
+    'j2_tests': {'starts_with_a': starts_with_a},
+}
+
+
+def clear_caches():
+    for name in (
+        '__get_environment',
+        '__get_template',
+        '__get_blocking',
+        '__may_block',
+        '__uses_blocking_test',
+    ):
+        j2.__dict__[name].cache_clear()
+
+
+async def check_blocking():
+    start = time.monotonic()
+    rendered = await j2.render_async({'a': '{{ slow_fqdn("a") }}', 'b': ['{{ slow_fqdn("b") }}']})
+    assert rendered == {'a': 'a.example.com', 'b': ['b.example.com']}
+    assert time.monotonic() - start < 0.55  # concurrently
+
+    assert await j2.render_async("{{ ['a1', 'b1', 'a2'] | select('starts_with_a') | list }}") == ['a1', 'a2']
+    assert await j2.render_async("{{ ['a1', 'b1'] | reject('starts_with_a') | list }}") == ['b1']
+    assert await j2.render_async("{{ 'b1' is starts_with_a }}") is False
+    tests = [
+        "'a1' is starts_with_a",
+        "['b1'] | select('starts_with_a') | list",
+        "undefined_var is starts_with_a",
+    ]
+    results = await j2.render_tests_async(tests, PROPS)
+    assert results[:2] == [True, False]
+    assert isinstance(results[2], j2.J2Error)
+
+
+def test():
+    assert j2.render(SPEC, PROPS) == RENDERED
+    assert j2.prerender(SPEC, {'env': PROPS['env']})(PROPS) == RENDERED
+    assert j2.render_test("user.name == 'user1'", PROPS)
+    assert not j2.render_test("'del' in old.perms", PROPS)
+    assert j2.render_print('old.name', PROPS) == 'host1'
+    assert j2.render_str('no {tags} at all\n', PROPS) == 'no {tags} at all'
+
+    rendered = j2.prerender(SPEC, {'env': PROPS['env']})(PROPS)
+    rendered['list'][2]['edit'] = False
+    assert j2.prerender(SPEC, {'env': PROPS['env']})(PROPS) == RENDERED
+
+    try:
+        j2.render({'a': {'b': '{{ undefined_var }}'}}, PROPS)
+        assert False
+    except j2.J2Error as error:
+        assert error.loc == '#/b/a'
+
+    try:
+        j2.prerender({'l': [1, '{{ undefined_var }}']}, {'env': {}})(PROPS)
+        assert False
+    except j2.J2Error as error:
+        assert error.loc == '#/{{ undefined_var }}/l'
+
+    assert asyncio.run(j2.render_async(SPEC, PROPS)) == RENDERED
+    render = j2.prerender(SPEC, {'env': PROPS['env']}, is_async=True)
+    assert asyncio.run(render(PROPS)) == RENDERED
+    tests = ["user.name == 'user1'", "'del' in old.perms", "undefined_var"]
+    results = asyncio.run(j2.render_tests_async(tests, PROPS))
+    assert results[:2] == [True, False]
+    assert isinstance(results[2], j2.J2Error)
+
+    assert j2.get_references("{{ user.name == old.data.owner }}") == {'user', 'old'}
+    assert j2.get_references("{{ x | length }}") == {'x'}
+    assert j2.get_references("{{ broken") is None
+
+    hits = j2.cache_info().hits
+    j2.render(SPEC, PROPS)
+    assert j2.cache_info().hits > hits
+
+    get_functions = plugin.get_functions
+    plugin.get_functions = lambda kind: PLUGINS.get(kind, {})
+    clear_caches()
+    try:
+        asyncio.run(check_blocking())
+        assert j2.render("{{ ['a1', 'b1'] | select('starts_with_a') | list }}") == ['a1']
+        assert j2.render('{{ slow_fqdn("c") }}') == 'c.example.com'
+    finally:
+        plugin.get_functions = get_functions
+        clear_caches()
@@ -0,0 +1,104 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.lib import j2
+from app.lib import perms
+from app.lib import plugin
+from app.model.inp import OperationRequest
+from app.model.out import User
+from app.model.spc import Specs
+
+ROLES = [
+    {
+        'all:host:see': 'true',
+        'set:host:lab:edt': "'lab' in user.name",
+        'host:host1:del': 'true',
+        'host:host1': 'true',
+        'set:host:broken': 'true',
+        'all:group:see': 'true',
+    },
+    {'set:x:see': 'true'},
+]
+
+CALLS = []
+
+
+def counted(kind):
+    CALLS.append(kind)
+    return True
+
+
+COUNTED_SPECS = {
+    'types': [],
+    'schema': {},
+    'roles_index': perms.index_roles([
+        {
+            'all:host:see': "counted('user') and user.name == 'test'",
+            'all:host:edt': "counted('old') and old.data.owner == user.name",
+            'set:host:lab:del': "counted('set')",
+        },
+    ]),
+    'sets': {'host': {'lab': "counted('lab') and old.name.startswith('lab')"}},
+}
+ENTITIES = {'lab1': 'test', 'web1': 'other', 'lab2': 'test'}
+
+
+def clear_caches():
+    for name in ('__get_environment', '__get_template', '__get_blocking', '__may_block'):
+        j2.__dict__[name].cache_clear()
+
+
+async def get_perms(memo):
+    specs = Specs.model_validate(COUNTED_SPECS)
+    result = {}
+    for name, owner in ENTITIES.items():
+        op = OperationRequest(
+            type='host',
+            name=name,
+            request=SimpleNamespace(headers={}, client=SimpleNamespace(host='::1')),
+            user=User(name='test', email='test@localhost', full_name='Test'),
+        )
+        result[name] = await perms.get_from_roles(op, specs, {'owner': owner}, memo=memo)
+    return result
+
+
+def check_memo():
+    full = ['del', 'edt', 'see']
+    expected = {'lab1': full, 'web1': ['see'], 'lab2': full}
+    assert asyncio.run(get_perms({})) == expected
+    # Tests using old or new are rendered for every entity, the others once
+    assert sorted(CALLS) == sorted(['user', 'set'] + ['old', 'lab'] * 3)
+
+    CALLS.clear()
+    assert asyncio.run(get_perms(None)) == expected
+    assert sorted(CALLS) == sorted(['user', 'set', 'old', 'lab'] * 3)
+
+
+def test():
+    index = perms.index_roles(ROLES)
+    assert index['host']['all'] == [('all:host:see', 'true', 'see')]
+    assert index['host']['set'] == [('set:host:lab:edt', "'lab' in user.name", ('lab', 'edt'))]
+    assert index['host']['names'] == {'host1': [('host:host1:del', 'true', 'del')]}
+    assert index['group']['all'] == [('all:group:see', 'true', 'see')]
+    # could also be a role for entity x of type set
+    assert index['set']['names']['x'] == [('set:x:see', 'true', 'see')]
+    assert perms.index_roles('no list') == {}
+
+    expanded = perms.__dict__['__expand_perms'](['edt+del', 'custom'])
+    assert expanded == ['custom', 'del', 'edt', 'see']
+    assert perms.has_all(expanded, ['see', 'custom'])
+    assert not perms.has_all(expanded, ['see', 'add'])
+    assert perms.has_any(expanded, ['add', 'custom'])
+    assert not perms.has_any(None, ['see'])
+    assert perms.to_names(perms.EXPANSIONS['all']) == [
+        'act', 'add', 'cln', 'cpy', 'del', 'edt', 'lnk', 'rnm', 'see'
+    ]
+
+    get_functions = plugin.get_functions
+    plugin.get_functions = lambda kind: {'counted': counted} if 'functions' in kind else {}
+    clear_caches()
+    try:
+        check_memo()
+    finally:
+        plugin.get_functions = get_functions
+        clear_caches()
@@ -0,0 +1,56 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.lib import plugin
+
+CALLS = []
+
+
+@plugin.cached(ttl=0.2, maxsize=2)
+def lookup(name, groups=[]):
+    CALLS.append(name)
+    return [name, *groups]
+
+
+@plugin.cached(ttl=60, maxsize=4)
+def slow_lookup(name):
+    time.sleep(0.01)
+    return {'name': name, 'groups': [name]}
+
+
+def lookup_and_modify(name):
+    result = slow_lookup(name)
+    result['groups'].append('modified')
+    return result['name']
+
+
+def test():
+    assert lookup('a', ['x']) == ['a', 'x']
+    assert lookup('a', ['x']) == ['a', 'x']
+    assert lookup('a', groups=['x']) == ['a', 'x']
+    assert CALLS == ['a', 'a']
+    info = lookup.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 2, 2)
+
+    lookup('a', ['x']).append('y')
+    assert lookup('a', ['x']) == ['a', 'x']
+
+    lookup('b')
+    lookup('c')
+    assert lookup.cache_info().currsize == 2
+    lookup('a', ['x'])
+    assert CALLS[-1] == 'a'
+
+    time.sleep(0.2)
+    lookup('c')
+    assert CALLS[-1] == 'c'
+    assert any(k.endswith('.lookup') for k in plugin.cache_info())
+
+    # Concurrent callers get their own copies and the stats add up
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        names = [f'n{i % 6}' for i in range(200)]
+        assert list(executor.map(lookup_and_modify, names)) == names
+    info = slow_lookup.cache_info()
+    assert info.hits + info.misses == 200 and info.currsize == 4
+    assert info.misses >= 6
+    assert slow_lookup('n0') == {'name': 'n0', 'groups': ['n0']}
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from app.lib import pool
+
+
+class Conn:
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+
+
+class StubPool(pool.Pool):
+    def __init__(self):
+        super().__init__(2, check_interval=0.0)
+        self.active = 0
+        self.max_active = 0
+
+    def connect(self):
+        return Conn()
+
+    def check(self, conn):
+        return conn.alive
+
+    def close(self, conn):
+        conn.closed = True
+
+
+def test():
+    p = StubPool()
+    lock = threading.Lock()
+
+    def use(conn):
+        with lock:
+            p.active += 1
+            p.max_active = max(p.max_active, p.active)
+        time.sleep(0.05)
+        with lock:
+            p.active -= 1
+        return conn
+
+    threads = [threading.Thread(target=p.call, args=(use,)) for _ in range(6)]
+    _ = [t.start() for t in threads]
+    _ = [t.join() for t in threads]
+    assert p.max_active <= 2
+    assert p.info().connects == 2 and p.info().idle == 2
+
+    conn = p.call(lambda c: c)
+    conn.alive = False
+    assert p.call(lambda c: c) is not conn
+    assert conn.closed
+
+    failed = []
+
+    def flaky(conn):
+        if not failed:
+            failed.append(conn)
+            raise ConnectionError('server down')
+        return conn
+
+    assert p.call(flaky, retry_on=(ConnectionError,)) is not failed[0]
+    assert failed[0].closed
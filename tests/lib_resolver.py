@@ -0,0 +1,73 @@
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.lib.resolver import Resolver
+
+CALLS = []
+ACTIVE = [0, 0]
+LOCK = threading.Lock()
+
+
+def gethostbyaddr(ip):
+    with LOCK:
+        CALLS.append(ip)
+        ACTIVE[0] += 1
+        ACTIVE[1] = max(ACTIVE)
+    time.sleep(0.02)
+    with LOCK:
+        ACTIVE[0] -= 1
+    if ip.endswith('.0'):
+        raise socket.herror(1, 'Unknown host')
+    return (f'host{ip.rsplit(".", 1)[1]}.example.com', [], [ip])
+
+
+def gethostbyname(hostname):
+    CALLS.append(hostname)
+    return '192.0.2.1'
+
+
+def test():
+    r = Resolver(concurrency=4, gethostbyaddr=gethostbyaddr, gethostbyname=gethostbyname)
+    ips = [f'192.0.2.{i}' for i in range(1, 17)]
+    start = time.monotonic()
+    assert r.to_fqhns(ips)[:2] == ['host1.example.com', 'host2.example.com']
+    assert time.monotonic() - start < 16 * 0.02
+    assert ACTIVE[1] == 4
+
+    assert r.to_fqhn('192.0.2.1') == 'host1.example.com'
+    assert r.to_ip('host1.example.com') == '192.0.2.1'
+    assert r.to_ip('host1.example.com') == '192.0.2.1'
+    assert len(CALLS) == 17
+
+    errors = []
+    for _ in range(2):
+        try:
+            r.to_fqhn('192.0.2.0')
+            assert False
+        except socket.herror as error:
+            errors.append(error)
+    assert len(CALLS) == 18
+    assert errors[0] is not errors[1] and errors[0].args == errors[1].args
+
+    # Every thread gets its own error from the negative cache
+    def to_error(ip):
+        try:
+            r.to_fqhn(ip)
+        except socket.herror as error:
+            return error
+        return None
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        errors = list(executor.map(to_error, ['192.0.2.0'] * 32))
+    assert len({id(e) for e in errors}) == 32 and len(CALLS) == 18
+    assert all(e.args == (1, 'Unknown host') and e.__context__ is None for e in errors)
+
+    # Single lookups are capped as well and concurrent misses share a lookup
+    ACTIVE[1] = 0
+    ips = [f'198.51.100.{i % 8 + 1}' for i in range(32)]
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        names = list(executor.map(r.to_fqhn, ips))
+    assert names[:2] == ['host1.example.com', 'host2.example.com']
+    assert ACTIVE[1] == 4 and len(CALLS) == 26
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+from app import consts
+from app.lib import plugin
+from app.lib import specs
+from app.model.err import SpecsError
+from app.model.inp import OperationRequest
+from app.model.out import User
+
+OP = OperationRequest(
+    type='host',
+    request=SimpleNamespace(headers={}, client=SimpleNamespace(host='127.0.0.1')),
+    user=User(name='test', email='test@localhost', full_name='Test'),
+)
+
+
+TYPES = """
+types:
+  - name: net
+    title: Networks
+  - name: host
+    title: Hosts
+    logs:
+      - {name: raw, title: Raw, plugin: raw, details: {by: '{{ user.name }}'}}
+      - {name: log, title: Log, plugin: log, details: {by: '{{ user.name }}'}}
+  - name: ip
+    title: IPs
+schema: {}
+"""
+
+PRERENDER = """
+request:
+  headers:
+    team: {pattern: '^[a-z]+$', default: nobody}
+types:
+  - name: host
+    title: '{{ user.name }}'
+    description: '{{ request.headers.team }} ({{ env.stage }})'
+    details: {stage: '{{ env.stage }}', kind: plain}
+schema: {}
+"""
+OTHER = OperationRequest(
+    type='host',
+    request=SimpleNamespace(
+        headers={'yac-team': 'red'}, client=SimpleNamespace(host='127.0.0.1')
+    ),
+    user=User(name='other', email='other@localhost', full_name='Other'),
+)
+
+
+class Repo:
+    """
+    Serves the specs document at commit (see specs.read_from_repo).
+    """
+
+    def __init__(self, commit, content):
+        self.commit = commit
+        self.content = content
+        self.reads = 0
+
+    async def get_hash(self):
+        return self.commit
+
+    async def get_specs(self, _):
+        self.reads += 1
+        return self.content
+
+
+def write(path, content):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+async def check(path):
+    write(path, 'types: []\nschema: {title: one}\n')
+    assert (await specs.read_from_file(OP)).json_schema.title == 'one'
+    key = specs.cache_info().key
+
+    # Steady traffic within the check interval is served from the cache ...
+    write(path, 'types: []\nschema: {title: two}\n')
+    deadline = time.monotonic() + consts.ENV.specs_file_check_interval
+    hits = specs.cache_info().hits
+    while time.monotonic() < deadline - 0.1:
+        assert (await specs.read_from_file(OP)).json_schema.title == 'one'
+        await asyncio.sleep(0.05)
+    assert specs.cache_info().hits > hits and specs.cache_info().key == key
+
+    # ... but does not keep the changed file from being picked up afterwards
+    for _ in range(100):
+        if (await specs.read_from_file(OP)).json_schema.title == 'two':
+            break
+        await asyncio.sleep(0.05)
+    assert specs.cache_info().key != key
+
+    # A broken file fails consistently until it is fixed (no stale specs)
+    write(path, 'types: [\n')
+    await asyncio.sleep(consts.ENV.specs_file_check_interval)
+    for _ in range(3):
+        try:
+            await specs.read_from_file(OP)
+            assert False
+        except SpecsError:
+            pass
+    write(path, 'types: []\nschema: {title: three}\n')
+    assert (await specs.read_from_file(OP)).json_schema.title == 'three'
+
+
+async def check_types():
+    # Only the type of the request is rendered (the other one would fail) ...
+    broken = TYPES.replace('title: IPs', "title: '{{ user.name + 1 }}'")
+    s = await specs.read_from_repo(Repo('types-broken', broken), OP)
+    assert [t.name for t in s.types] == ['host'] and s.type.name == 'host'
+    try:
+        await specs.read_from_repo(Repo('types-broken', broken), OP, all_types=True)
+        assert False
+    except SpecsError:
+        pass
+
+    # ... unless all types are requested (e.g. to list them), in their order
+    s = await specs.read_from_repo(Repo('types', TYPES), OP, all_types=True)
+    assert [t.name for t in s.types] == ['net', 'host', 'ip'] and s.type.name == 'host'
+
+    # The details of plugins with RAW_DETAILS are left as they are
+    assert s.type.logs[0].details == {'by': '{{ user.name }}'}
+    assert s.type.logs[1].details == {'by': 'test'}
+
+
+async def check_commits():
+    rpo = Repo('c1', TYPES)
+    await specs.read_from_repo(rpo, OP)
+    info = specs.cache_info()
+
+    # Reads at the same commit are served from the cache
+    assert (await specs.read_from_repo(rpo, OP)).type.title == 'Hosts'
+    assert rpo.reads == 1 and specs.cache_info() == (info.hits + 1, info.misses, 'c1')
+
+    # A new commit (changing the specs) is compiled again
+    rpo.commit, rpo.content = 'c2', TYPES.replace('Hosts', 'Servers')
+    assert (await specs.read_from_repo(rpo, OP)).type.title == 'Servers'
+    assert rpo.reads == 2 and specs.cache_info() == (info.hits + 1, info.misses + 1, 'c2')
+
+    # Specs failing to compile are not cached
+    rpo.commit, rpo.content = 'c3', 'types: [\n'
+    for _ in range(2):
+        try:
+            await specs.read_from_repo(rpo, OP)
+            assert False
+        except SpecsError:
+            pass
+    assert rpo.reads == 4 and specs.cache_info().key == 'c2'
+
+
+async def check_prerender():
+    env = consts.ENV.env
+    consts.ENV.env = {'stage': 'dev'}
+    try:
+        rpo = Repo('prerender', PRERENDER)
+        first = (await specs.read_from_repo(rpo, OP)).type
+        # Only seen by what is rendered per request, not by the static parts
+        consts.ENV.env = {'stage': 'prod'}
+        second = (await specs.read_from_repo(rpo, OTHER)).type
+    finally:
+        consts.ENV.env = env
+    assert rpo.reads == 1
+    assert (first.title, first.description) == ('test', 'nobody (dev)')
+    assert (second.title, second.description) == ('other', 'red (prod)')
+    assert first.details == second.details == {'stage': 'dev', 'kind': 'plain'}
+
+
+def test():
+    env = consts.ENV.specs
+    with tempfile.TemporaryDirectory() as path:
+        consts.ENV.specs = os.path.join(path, 'yac.yml')
+        try:
+            asyncio.run(check(consts.ENV.specs))
+        finally:
+            consts.ENV.specs = env
+
+    get_module = plugin.get_module
+    plugin.get_module = lambda kind, name: SimpleNamespace(RAW_DETAILS=name == 'raw')
+    try:
+        asyncio.run(check_types())
+        asyncio.run(check_commits())
+        asyncio.run(check_prerender())
+    finally:
+        plugin.get_module = get_module
@@ -1,5 +1,23 @@
+import lib_git
+import lib_j2
 import lib_locs
+import lib_perms
+import lib_plugin
+import lib_pool
+import lib_resolver
+import lib_specs
 import lib_yaml
+import plugin_eth_isginf
+import plugin_git_direct
 
+lib_git.test()
+lib_j2.test()
 lib_locs.test()
+lib_perms.test()
+lib_plugin.test()
+lib_pool.test()
+lib_resolver.test()
+lib_specs.test()
 lib_yaml.test()
+plugin_eth_isginf.test()
+plugin_git_direct.test()
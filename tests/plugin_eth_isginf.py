@@ -0,0 +1,111 @@
+import importlib
+import os
+import sys
+import types
+
+ENV = {
+    'YAC_ISGINF_LDAPSEARCH_URL': 'ldaps://ldap.example.com/',
+    'YAC_ISGINF_LDAPSEARCH_BIND_DN': 'cn=yac,ou=admins,o=example,c=com',
+    'YAC_ISGINF_LDAPSEARCH_BIND_PW': 'secret',
+    'YAC_ISGINF_LDAPSEARCH_POOL': '2',
+    'YAC_ISGINF_LDAPSEARCH_TTL': '0',
+}
+CONNS = []
+FAILURES = []  # raised by the next searches
+
+
+class LdapError(Exception):
+    pass
+
+
+class Conn:
+    def __init__(self, url):
+        self.url = url
+        self.options = {}
+        self.bound = None
+        self.unbound = False
+
+    def set_option(self, option, value):
+        self.options[option] = value
+
+    def simple_bind_s(self, dn, pw):
+        self.bound = (dn, pw)
+
+    def whoami_s(self):
+        return f'dn:{self.bound[0]}'
+
+    def unbind_s(self):
+        self.unbound = True
+
+    def search_s(self, dn, scope, filterstr, attrlist):
+        if FAILURES:
+            raise FAILURES.pop(0)
+        return [(f'cn=user{i},{dn}', {attrlist[0]: [f'user{i}'.encode()]}) for i in (0, 1)]
+
+
+def initialize(url):
+    CONNS.append(Conn(url))
+    return CONNS[-1]
+
+
+def fake_ldap():
+    ldap = types.ModuleType('ldap')
+    ldap.initialize = initialize
+    ldap.SCOPE_BASE, ldap.SCOPE_ONELEVEL, ldap.SCOPE_SUBTREE, ldap.SCOPE_SUBORDINATE = range(4)
+    ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER, ldap.OPT_X_TLS_NEWCTX = range(3)
+    for name in ('NO_SUCH_OBJECT', 'INVALID_DN_SYNTAX', 'SERVER_DOWN', 'CONNECT_ERROR'):
+        setattr(ldap, name, type(name, (LdapError,), {}))
+    return ldap
+
+
+def check(isginf, ldap):
+    assert isginf.isginf_ldap_search('ou=users') == ['user0', 'user1']
+    conn = CONNS[-1]
+    assert conn.url == ENV['YAC_ISGINF_LDAPSEARCH_URL']
+    assert conn.bound == (ENV['YAC_ISGINF_LDAPSEARCH_BIND_DN'], 'secret')
+    assert conn.options == {
+        ldap.OPT_X_TLS_REQUIRE_CERT: ldap.OPT_X_TLS_NEVER,
+        ldap.OPT_X_TLS_NEWCTX: 0,
+    }
+    dns = isginf.isginf_ldap_search('ou=users', attr='dn')
+    assert dns == ['cn=user0,ou=users', 'cn=user1,ou=users']
+    assert len(CONNS) == 1  # reused
+
+    assert isginf.isginf_ldap_search('ou=users', cert_check=True) == ['user0', 'user1']
+    assert len(CONNS) == 2 and CONNS[-1].options == {}
+
+    # Reconnects if the server went away
+    FAILURES.append(ldap.SERVER_DOWN())
+    assert isginf.isginf_ldap_search('ou=users') == ['user0', 'user1']
+    assert conn.unbound and len(CONNS) == 3
+    assert isginf.POOLS[False].info().discards == 1
+
+    # Expected errors keep the connection, others discard it
+    FAILURES.append(ldap.NO_SUCH_OBJECT())
+    assert isginf.isginf_ldap_search('ou=missing') == []
+    assert not CONNS[-1].unbound
+    FAILURES.append(RuntimeError('broken'))
+    try:
+        isginf.isginf_ldap_search('ou=users')
+        assert False
+    except RuntimeError:
+        pass
+    assert CONNS[-1].unbound
+    info = isginf.POOLS[False].info()
+    assert (info.connects, info.discards, info.idle) == (2, 2, 0)
+
+
+def test():
+    env = {key: os.environ.get(key) for key in ENV}
+    os.environ.update(ENV)
+    sys.modules['ldap'] = ldap = fake_ldap()
+    try:
+        check(importlib.import_module('app.plugin.j2_functions.eth_isginf'), ldap)
+    finally:
+        del sys.modules['ldap']
+        sys.modules.pop('app.plugin.j2_functions.eth_isginf', None)
+        for key, value in env.items():
+            if value is None:
+                del os.environ[key]
+            else:
+                os.environ[key] = value
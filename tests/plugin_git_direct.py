@@ -0,0 +1,469 @@
+import asyncio
+import os
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+from app.lib import git
+from app.model.err import RepoConflict
+from app.model.err import RepoError
+from app.plugin.repo import git_direct
+from app.plugin.repo.git_direct import Index
+
+FPATH = 'hosts/{name}/host.yml'
+
+
+def run(path, *args):
+    subprocess.run(['git', *args], cwd=path, check=True, capture_output=True)
+
+
+def write(path, file, content):
+    os.makedirs(os.path.dirname(f'{path}/{file}'), exist_ok=True)
+    with open(f'{path}/{file}', 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def rev_parse(path, rev):
+    return subprocess.check_output(['git', 'rev-parse', rev], cwd=path).decode().strip()
+
+
+def push(path, file, content):
+    run(path, 'pull', '-q')
+    write(path, file, content)
+    commit(path, file)
+    run(path, 'push', '-q')
+
+
+def push_delete(path, file):
+    run(path, 'pull', '-q')
+    os.remove(f'{path}/{file}')
+    commit(path, file)
+    run(path, 'push', '-q')
+
+
+def push_link(path, file, src):
+    run(path, 'pull', '-q')
+    os.symlink(src, f'{path}/{file}')
+    commit(path, file)
+    run(path, 'push', '-q')
+
+
+@contextmanager
+def pushed_before(change, *args):
+    """
+    Someone else pushes (change with args) right before the next push of a
+    GitRepo.
+    """
+    original = git.Repo.push
+
+    async def push_after(self, *a, **kwargs):
+        git.Repo.push = original
+        change(*args)
+        return await original(self, *a, **kwargs)
+
+    git.Repo.push = push_after
+    try:
+        yield
+    finally:
+        git.Repo.push = original
+
+
+@contextmanager
+def slow_push():
+    """
+    The pushes of GitRepos only start once release is set.
+    """
+    original = git.Repo.push
+    entered, release = asyncio.Event(), asyncio.Event()
+
+    async def push_later(self, *args, **kwargs):
+        entered.set()
+        await release.wait()
+        return await original(self, *args, **kwargs)
+
+    git.Repo.push = push_later
+    try:
+        yield entered, release
+    finally:
+        git.Repo.push = original
+
+
+def commit(path, msg):
+    run(path, 'add', '-A')
+    run(path, '-c', 'user.name=test', '-c', 'user.email=test@localhost', 'commit', '-m', msg)
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=path).decode().strip()
+
+
+async def check(path):
+    repo = git.Repo(path)
+
+    write(path, 'hosts/a/host.yml', 'a: 1\n')
+    write(path, 'hosts/b/host.yml', 'b: 1\n')
+    write(path, 'hosts/b/other.yml', 'x: 1\n')
+    os.makedirs(f'{path}/hosts/c')
+    os.symlink('../a/host.yml', f'{path}/hosts/c/host.yml')
+    os.makedirs(f'{path}/hosts/f')
+    os.symlink('../a/host.yml', f'{path}/hosts/f/host.yml')
+    os.makedirs(f'{path}/hosts/g')
+    os.symlink('../e/host.yml', f'{path}/hosts/g/host.yml')
+    os.symlink('../../../outside', f'{path}/hosts/bad')
+    write(path, 'hosts/.hidden/host.yml', 'h: 1\n')
+    index = await Index.build(repo, commit(path, 'init'))
+
+    assert index.names(FPATH) == ['a', 'b', 'c', 'f', 'g']
+    assert index.exists('hosts/c/host.yml') and index.is_link('hosts/c/host.yml')
+    assert index.resolve('hosts/c/host.yml') == 'hosts/a/host.yml'
+    assert not index.exists('hosts/d/host.yml')
+    assert index.resolve('hosts/bad') is None
+    assert index.linked_by('hosts/a/host.yml') == ['hosts/c/host.yml', 'hosts/f/host.yml']
+    assert index.linked_by('hosts/b/host.yml') == []
+    assert index.linked_by('hosts/c/host.yml') == []  # not its siblings
+    assert index.linked_by('hosts/e/host.yml') == ['hosts/g/host.yml']
+
+    os.remove(f'{path}/hosts/a/host.yml')
+    write(path, 'hosts/d/host.yml', 'd: 1\n')
+    os.symlink('c', f'{path}/hosts/e')  # g now resolves through it
+    os.remove(f'{path}/hosts/f/host.yml')
+    os.symlink('../b/host.yml', f'{path}/hosts/f/host.yml')
+    index = await index.update(repo, commit(path, 'change'))
+
+    # The reverse index is carried over and updated, not built again
+    links = index._links
+    assert links is not None
+    assert index.names(FPATH) == ['b', 'c', 'd', 'f', 'g']
+    assert not index.exists('hosts/c/host.yml') and index.is_link('hosts/c/host.yml')
+    assert index.resolve('hosts/e/host.yml') == 'hosts/a/host.yml'
+    assert index.is_link('hosts/e/host.yml') and not index.is_link('hosts/d/host.yml')
+    assert index.linked_by('hosts/a/host.yml') == ['hosts/c/host.yml', 'hosts/g/host.yml']
+    assert index.linked_by('hosts/b/host.yml') == ['hosts/f/host.yml']
+    assert index.linked_by('hosts/e/host.yml') == []
+    assert index._links is links
+    built = await Index.build(repo, index.commit)
+    built.linked_by('hosts/a/host.yml')
+    assert links == built._links and index._visitors == built._visitors
+    assert index.entries == (await Index.build(repo, index.commit)).entries
+    await git.Batch.reset(path)
+
+
+async def write_entity(rpo, name, old, new):
+    async with rpo.writer(None, details={}) as r:
+        r.update_details({'file': 'hosts/{name}.yml'})
+        return await r.write(name, old, new, f'Write {name}')
+
+
+async def check_group(remote, seed, path):
+    rpo = git_direct.GitRepo()
+    rpo.path = path
+    rpo.update_details({'file': 'hosts/{name}.yml'})
+
+    results = await asyncio.gather(
+        *(write_entity(rpo, f'x{i}', '', f'x: {i}\n') for i in range(5)),
+        write_entity(rpo, 'a', 'a: 0\n', 'a: 2\n'),
+        return_exceptions=True,
+    )
+    assert [d.name for d in results[:5]] == [f'x{i}' for i in range(5)]
+    assert len({d.hash for d in results[:5]}) == 5
+    assert isinstance(results[5], RepoConflict)
+    assert rev_parse(remote, 'main') == results[4].hash
+    count = subprocess.check_output(['git', 'rev-list', '--count', 'main'], cwd=remote)
+    assert int(count) == 6
+
+    # Someone else pushes before the group is pushed (commits are rebased)
+    with pushed_before(push, seed, 'hosts/z.yml', 'z: 1\n'):
+        results = await asyncio.gather(
+            *(write_entity(rpo, f'y{i}', '', 'y: 1\n') for i in range(2))
+        )
+    assert rev_parse(remote, 'main') == results[1].hash
+    assert rev_parse(remote, 'main~1') == results[0].hash
+    assert await rpo.exists('z') and await rpo.exists('y1')
+
+    # ... and changes the file of one of them (only this one is dropped)
+    with pushed_before(push, seed, 'hosts/a.yml', 'a: 3\n'):
+        results = await asyncio.gather(
+            write_entity(rpo, 'a', 'a: 1\n', 'a: 2\n'),
+            write_entity(rpo, 'v', '', 'v: 1\n'),
+            return_exceptions=True,
+        )
+    assert isinstance(results[0], RepoConflict)
+    assert rev_parse(remote, 'main') == results[1].hash
+    assert rev_parse(remote, 'main~1') == rev_parse(seed, 'HEAD')
+    assert await rpo.get('a') == 'a: 3\n' and await rpo.get('v') == 'v: 1\n'
+
+    git_direct.GROUP_WINDOW = 0
+    async with rpo.writer(None, details={}) as r:
+        push(seed, 'hosts/w.yml', 'w: 1\n')
+        diff = await r.write('a', 'a: 3\n', 'a: 4\n', 'Write a')
+    assert rev_parse(remote, 'main') == diff.hash
+    assert await rpo.exists('w')
+    await git.Batch.reset(path)
+
+
+async def check_rename(remote, path):
+    rpo = git_direct.GitRepo()
+    rpo.path = path
+    rpo.update_details({'file': 'hosts/{name}.yml'})
+    await write_entity(rpo, 'old', '', 'old: 1\n')
+
+    async with rpo.writer(None, details={}) as r:
+        r.update_details({'file': 'hosts/{name}.yml'})
+        diff = await r.write_rename('old', 'new', 'old: 1\n', 'new: 1\n', 'Rename')
+    assert diff.name == 'new' and rev_parse(remote, 'main') == diff.hash
+    assert not await rpo.exists('old') and await rpo.get('new') == 'new: 1\n'
+    await git.Batch.reset(path)
+
+
+async def check_sources(seed, path):
+    rpo = git_direct.GitRepo()
+    rpo.path = path
+    rpo.update_details({'file': 'hosts/{name}.yml'})
+
+    async def change(op, *args):
+        async with rpo.writer(None, details={}) as r:
+            r.update_details({'file': 'hosts/{name}.yml'})
+            return await getattr(r, op)(*args)
+
+    await write_entity(rpo, 'src', '', 'src: 1\n')
+
+    # The source of a copy is changed upstream
+    with pushed_before(push, seed, 'hosts/src.yml', 'src: 2\n'):
+        try:
+            await change('copy', 'cpy', 'src', 'Copy src')
+            assert False
+        except RepoConflict:
+            pass
+    assert not await rpo.exists('cpy') and await rpo.get('src') == 'src: 2\n'
+
+    # The source of a link is deleted upstream
+    with pushed_before(push_delete, seed, 'hosts/src.yml'):
+        try:
+            await change('link', 'lnk', 'src', 'Link src')
+            assert False
+        except RepoConflict:
+            pass
+    assert not await rpo.exists('lnk') and not await rpo.exists('src')
+
+    # A file is linked upstream right before it is deleted
+    await write_entity(rpo, 'del', '', 'del: 1\n')
+    with pushed_before(push_link, seed, 'hosts/dlnk.yml', 'del.yml'):
+        try:
+            await change('delete', 'del', 'Delete del')
+            assert False
+        except RepoConflict:
+            pass
+    assert await rpo.exists('del') and await rpo.is_link('dlnk')
+    await git.Batch.reset(path)
+
+
+async def list_entities(rpo, dirty=True):
+    async with rpo.reader(None, details={}, dirty=dirty) as r:
+        r.update_details({'file': 'hosts/{name}.yml'})
+        return await r.list()
+
+
+async def check_fetcher(seed, path):
+    rpo = git_direct.GitRepo()
+    rpo.path = path
+
+    assert 'f' not in await list_entities(rpo)
+    push(seed, 'hosts/f.yml', 'f: 1\n')
+    assert 'f' not in await list_entities(rpo)  # until the next fetch
+
+    # Reads wait for the fetch they start (as the last one is too old)
+    git_direct.MAX_STALENESS = 0
+    git_direct.STRICT = True
+    assert 'f' in await list_entities(rpo)
+    push(seed, 'hosts/g.yml', 'g: 1\n')
+    assert 'g' in await list_entities(rpo)
+
+    # Fetching goes on after unexpected errors (which strict reads get)
+    fetch = git.Repo.fetch
+
+    async def broken_fetch(self, *args, **kwargs):
+        raise RuntimeError('broken')
+
+    git.Repo.fetch = broken_fetch
+    push(seed, 'hosts/h.yml', 'h: 1\n')
+    try:
+        await asyncio.wait_for(list_entities(rpo), 5)
+        assert False
+    except RepoError:
+        pass
+    finally:
+        git.Repo.fetch = fetch
+    assert 'h' in await list_entities(rpo)
+    await git.Batch.reset(path)
+
+
+async def check_probe(seed, path):
+    rpo = git_direct.GitRepo()
+    rpo.path = path
+    calls = {'pull': 0, 'ls_remote': 0}
+    pull, ls_remote = git.Repo.pull, git.Repo.ls_remote
+
+    async def count_pull(self, *args, **kwargs):
+        calls['pull'] += 1
+        return await pull(self, *args, **kwargs)
+
+    async def count_ls_remote(self, *args, **kwargs):
+        calls['ls_remote'] += 1
+        return await ls_remote(self, *args, **kwargs)
+
+    git.Repo.pull, git.Repo.ls_remote = count_pull, count_ls_remote
+    try:
+        await list_entities(rpo, dirty=False)
+        calls.update({'pull': 0, 'ls_remote': 0})
+        await asyncio.gather(*(list_entities(rpo, dirty=False) for _ in range(5)))
+        assert calls == {'pull': 0, 'ls_remote': 1}
+
+        push(seed, 'hosts/p.yml', 'p: 1\n')
+        assert 'p' not in await list_entities(rpo, dirty=False)  # probe is reused
+        # Once it expired, the reader and then its writer probe again
+        git_direct.PROBE_TTL = 1e-6
+        assert 'p' in await list_entities(rpo, dirty=False)
+        assert calls == {'pull': 1, 'ls_remote': 3}
+    finally:
+        git.Repo.pull, git.Repo.ls_remote = pull, ls_remote
+    await git.Batch.reset(path)
+
+
+async def check_snapshot(path):
+    rpo = git_direct.GitRepo()
+    rpo.path = path
+
+    async with rpo.reader(None, details={}) as r:
+        r.update_details({'file': 'hosts/{name}.yml'})
+        names, head = await r.list(), await r.get_hash()
+        diff = await write_entity(rpo, 's', '', 's: 1\n')
+        assert await r.list() == names and await r.get_hash() == head
+        assert 's' not in names and diff.hash != head
+    assert 's' in await list_entities(rpo)
+
+    # Readers do not wait for a slow push (alone or of a group) nor see it
+    for window in (0, 0.1):
+        git_direct.GROUP_WINDOW = window
+        with slow_push() as (entered, release):
+            task = asyncio.create_task(write_entity(rpo, f't{window}', '', 't: 1\n'))
+            await entered.wait()
+            start = time.monotonic()
+            names = await asyncio.wait_for(list_entities(rpo, dirty=False), 2)
+            assert f't{window}' not in names
+            assert time.monotonic() - start < 1
+            release.set()
+            await task
+        assert f't{window}' in await list_entities(rpo, dirty=False)
+    git_direct.GROUP_WINDOW = 0
+    await git.Batch.reset(path)
+
+
+async def check_entity_locks(path):
+    rpo = git_direct.GitRepo()
+    rpo.path = path
+    rpo.update_details({'file': 'hosts/{name}.yml'})
+    await write_entity(rpo, 'k', '', 'k: 1\n')
+    entered, release = asyncio.Event(), asyncio.Event()
+    read = rpo._GitRepo__read
+
+    async def slow_read(file, index=None):
+        if file == 'hosts/k.yml':
+            entered.set()
+            await release.wait()
+        return await read(file, index)
+
+    # A slow check only blocks the writers of the same entity
+    rpo._GitRepo__read = slow_read
+    slow = asyncio.create_task(write_entity(rpo, 'k', 'k: 1\n', 'k: 2\n'))
+    await entered.wait()
+    same = asyncio.create_task(write_entity(rpo, 'k', 'k: 1\n', 'k: 3\n'))
+    diff = await asyncio.wait_for(write_entity(rpo, 'l', '', 'l: 1\n'), 2)
+    assert rev_parse(path, 'HEAD') == diff.hash and not same.done()
+    release.set()
+    results = await asyncio.gather(slow, same, return_exceptions=True)
+    assert rev_parse(path, 'HEAD') == results[0].hash
+    assert isinstance(results[1], RepoConflict)
+    rpo._GitRepo__read = read
+    assert await rpo.get('k') == 'k: 2\n' and await rpo.exists('l')
+
+    info = rpo.lock_info()
+    assert {'pull', 'entity', 'commit'} <= set(info)
+    assert info['entity'].count == 4 and info['entity'].wait_max > 0
+    await git.Batch.reset(path)
+
+
+async def check_mirror(remote, seed, mirror, paths):
+    workers = [git_direct.GitRepo() for _ in paths]
+    for rpo, path in zip(workers, paths):
+        rpo.path = path
+    workers[1].update_details({'file': 'hosts/{name}.yml'})
+
+    diff = await write_entity(workers[0], 'm', '', 'm: 1\n')
+    async with workers[1].reader(None, details={}) as r:
+        r.update_details({'file': 'hosts/{name}.yml'})
+        assert await r.get('m') == 'm: 1\n'
+    assert rev_parse(mirror, 'main') == diff.hash
+    for path in paths:
+        with open(f'{path}/.git/objects/info/alternates', encoding='utf-8') as f:
+            assert f.read().strip() == f'{mirror}/objects'
+
+    # Rebasing fetches through the mirror as well
+    async with workers[1].writer(None, details={}) as r:
+        push(seed, 'hosts/n.yml', 'n: 1\n')
+        diff = await r.write('m', 'm: 1\n', 'm: 2\n', 'Write m')
+    assert rev_parse(remote, 'main') == diff.hash
+    assert await workers[1].exists('n')
+    for path in paths:
+        await git.Batch.reset(path)
+
+
+def test():
+    with tempfile.TemporaryDirectory() as path:
+        run(path, 'init', '-q')
+        asyncio.run(check(path))
+
+    window = git_direct.GROUP_WINDOW
+    url = git_direct.URL
+    mirror = git_direct.MIRROR
+    interval = git_direct.FETCH_INTERVAL
+    ttl = git_direct.PROBE_TTL
+    staleness = git_direct.MAX_STALENESS
+    strict = git_direct.STRICT
+    with tempfile.TemporaryDirectory() as path:
+        run(path, 'init', '-q', '--bare', '-b', 'main', 'remote')
+        run(path, 'clone', '-q', 'remote', 'seed')
+        write(f'{path}/seed', 'hosts/a.yml', 'a: 1\n')
+        commit(f'{path}/seed', 'init')
+        run(f'{path}/seed', 'push', '-q', 'origin', 'HEAD:main')
+        git_direct.GROUP_WINDOW = 0.2
+        git_direct.URL = f'{path}/remote'
+        try:
+            asyncio.run(check_group(f'{path}/remote', f'{path}/seed', f'{path}/work'))
+            git_direct.GROUP_WINDOW = 0
+            git_direct.MIRROR = f'{path}/mirror.git'
+            asyncio.run(
+                check_mirror(
+                    f'{path}/remote',
+                    f'{path}/seed',
+                    f'{path}/mirror.git',
+                    [f'{path}/w1', f'{path}/w2'],
+                )
+            )
+            git_direct.MIRROR = mirror
+            asyncio.run(check_rename(f'{path}/remote', f'{path}/r'))
+            asyncio.run(check_sources(f'{path}/seed', f'{path}/c'))
+            git_direct.FETCH_INTERVAL = 60
+            asyncio.run(check_fetcher(f'{path}/seed', f'{path}/f'))
+            git_direct.FETCH_INTERVAL = 0
+            git_direct.PROBE_TTL = 60
+            asyncio.run(check_probe(f'{path}/seed', f'{path}/p'))
+            git_direct.PROBE_TTL = ttl
+            asyncio.run(check_snapshot(f'{path}/s'))
+            asyncio.run(check_entity_locks(f'{path}/e'))
+        finally:
+            git_direct.FETCH_INTERVAL = interval
+            git_direct.PROBE_TTL = ttl
+            git_direct.MAX_STALENESS = staleness
+            git_direct.STRICT = strict
+            git_direct.GROUP_WINDOW = window
+            git_direct.URL = url
+            git_direct.MIRROR = mirror
+